@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+import stand_ins
+
+
+YOUTUBE_CHANNEL_ID = 1001
+TWITCH_CHANNEL_ID = 1002
+TARGET_CHANNEL_BASE = 2000
+
+
+class SinkChannel:
+    def __init__(self, channel_id: int, session: aiohttp.ClientSession, base_url: str, http_exception):
+        self.id = channel_id
+        self.guild = None
+        self.session = session
+        self.url = f"{base_url}/channels/{channel_id}/messages"
+        self.http_exception = http_exception
+
+    async def send(self, content=None, embed=None, components=None, files=None):
+        payload = {"content": content, "embeds": [embed.to_dict()] if embed else []}
+        if files:
+            payload["attachments"] = [{"filename": file.filename} for file in files]
+        async with self.session.post(self.url, json=payload) as resp:
+            data = await resp.json()
+            if resp.status >= 400:
+                raise self.http_exception(resp, data)
+        return SimpleNamespace(id=int(data["id"]), channel_id=self.id)
+
+    async def edit_message(self, message_id: int, embed=None):
+        payload = {"embeds": [embed.to_dict()] if embed else []}
+        async with self.session.patch(f"{self.url}/{message_id}", json=payload) as resp:
+            data = await resp.json()
+            if resp.status >= 400:
+                raise self.http_exception(resp, data)
+        return SimpleNamespace(id=int(data["id"]), channel_id=self.id)
+
+
+async def poll_sources(scheduler):
+    scheduler.sync_sources()
+    sources = list(scheduler.sources.values())
+    await asyncio.gather(
+        scheduler.poll_youtube_sources([source for source in sources if source.kind == "youtube"]),
+        scheduler.poll_twitch_sources([source for source in sources if source.kind == "twitch"])
+    )
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+class Phase:
+    def __init__(self, name: str):
+        self.name = name
+        self.events = 0
+        self.latencies = []
+        self.seconds = 0.0
+        self.memory = 0
+        self.peak = 0
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        if tracemalloc.is_tracing():
+            self.memory, self.peak = tracemalloc.get_traced_memory()
+
+    def result(self) -> dict:
+        return {
+            "phase": self.name,
+            "events": self.events,
+            "seconds": round(self.seconds, 3),
+            "throughput": round(self.events / self.seconds, 1) if self.seconds else 0.0,
+            "p50_ms": round(percentile(self.latencies, 0.5) * 1000, 1),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 1),
+            "memory_mib": round(self.memory / 2 ** 20, 1),
+            "peak_mib": round(self.peak / 2 ** 20, 1),
+        }
+
+
+def collect_latencies(phase: Phase, sink_app: web.Application, published: dict, delivered: set):
+    for message in sink_app["messages"]:
+        embed = (message.get("embeds") or [{}])[0]
+        key = next((key for key in (embed.get("url"), embed.get("title")) if key in published), None)
+        if key is not None:
+            phase.latencies.append(message["received_at"] - published[key])
+            phase.events += 1
+            delivered.add(key)
+    sink_app["messages"].clear()
+
+
+async def run(args) -> list[dict]:
+    random.seed(args.seed)
+    if not args.no_memory:
+        tracemalloc.start()
+    channel_ids = [f"UC{i:022d}" for i in range(args.sources)]
+    usernames = [f"streamer{i}" for i in range(args.streamers)]
+    feeds_app = stand_ins.create_youtube_feed_app(channel_ids, latency=args.feed_latency)
+    thumbnails_app = stand_ins.create_thumbnail_app(args.thumbnail_latency, args.missing_maxres)
+    twitch_app = stand_ins.create_twitch_app(set(), args.twitch_latency)
+    sink_app = stand_ins.create_discord_sink_app(args.discord_latency, args.rate_limit_every, args.webhook_rate or int(args.channel_rate), args.webhook_per)
+    runners = []
+    urls = {}
+    for name, app in (("youtube", feeds_app), ("thumbnails", thumbnails_app), ("twitch", twitch_app), ("discord", sink_app)):
+        runner, urls[name] = await stand_ins.start_stand_in(app)
+        runners.append(runner)
+
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    youtube_targets = [YOUTUBE_CHANNEL_ID] + [TARGET_CHANNEL_BASE + i for i in range(args.targets - 1)]
+    twitch_targets = [TWITCH_CHANNEL_ID] + [TARGET_CHANNEL_BASE + i for i in range(args.targets - 1)]
+    os.environ.update({
+        "YOUTUBE_CHANNEL_ID": str(YOUTUBE_CHANNEL_ID),
+        "TWITCH_CHANNEL_ID": str(TWITCH_CHANNEL_ID),
+        "YOUTUBE_TARGET_CHANNEL_IDS": ",".join(map(str, youtube_targets)),
+        "TWITCH_TARGET_CHANNEL_IDS": ",".join(map(str, twitch_targets)),
+        "NEWS_TARGET_CHANNEL_IDS": ",".join(map(str, youtube_targets)),
+        "YOUTUBE_FEEDS": ",".join(stand_ins.feed_url(urls["youtube"], channel_id) for channel_id in channel_ids),
+        "YOUTUBE_THUMBNAIL_URL": urls["thumbnails"] + "/vi/{video_id}/{quality}.jpg",
+        "TWITCH_USERNAMES": ",".join(usernames),
+        "TWITCH_LIVENESS_BACKEND": "helix",
+        "TWITCH_HELIX_URL": urls["twitch"] + "/helix",
+        "TWITCH_TOKEN_URL": urls["twitch"] + "/oauth2/token",
+        "TWITCH_CLIENT_ID": "bench",
+        "TWITCH_CLIENT_SECRET": "bench",
+        "STATE_FILE": os.path.join(workdir, "state.json"),
+        "STATE_DB": os.path.join(workdir, "state.sqlite3"),
+        "TEMPLATES_FILE": os.path.join(workdir, "templates.json"),
+        "RSS_FETCH_CONCURRENCY": str(args.concurrency),
+        "DISCORD_CHANNEL_RATE": str(args.channel_rate),
+        "DISCORD_CHANNEL_PER": "1",
+        "DELIVERY_BACKEND": args.delivery,
+        "WEBHOOKS_FILE": os.path.join(workdir, "webhooks.json"),
+    })
+    with open(os.environ["WEBHOOKS_FILE"], "w", encoding="utf-8") as f:
+        json.dump({str(channel_id): f"{urls['discord']}/webhooks/{channel_id}/token" for channel_id in set(youtube_targets) | set(twitch_targets)}, f)
+    main = importlib.import_module("main")
+    logging.getLogger().setLevel(args.log_level)
+
+    sink_session = aiohttp.ClientSession()
+    channels = {
+        channel_id: SinkChannel(channel_id, sink_session, urls["discord"], main.disnake.HTTPException)
+        for channel_id in set(youtube_targets) | set(twitch_targets)
+    }
+
+    async def change_presence(**kwargs):
+        pass
+
+    main.bot.get_channel = channels.get
+    main.bot.change_presence = change_presence
+    main.http_session = main.create_http_session()
+    main.send_lock = asyncio.Lock()
+    main.twitch_executor = ThreadPoolExecutor(max_workers=main.TWITCH_CHECK_WORKERS, thread_name_prefix="twitch-check")
+    main.feed_parse_executor = ThreadPoolExecutor(max_workers=main.RSS_PARSE_WORKERS, thread_name_prefix="feed-parse")
+    main.state_store.bind(asyncio.get_running_loop())
+    main.dispatcher.start()
+
+    news_app = web.Application()
+    news_app.add_routes([web.post("/news", main.telegram_news_handler)])
+    news_runner, news_url = await stand_ins.start_stand_in(news_app)
+    runners.append(news_runner)
+
+    results = []
+    try:
+        with Phase("rss cold poll") as phase:
+            await main.get_latest_youtube_video(feeds=main.YOUTUBE_FEEDS)
+            phase.events = len(channel_ids)
+        results.append(phase.result())
+
+        with Phase("rss warm poll (304)") as phase:
+            await main.get_latest_youtube_video(feeds=main.YOUTUBE_FEEDS)
+            phase.events = len(channel_ids)
+        results.append(phase.result())
+
+        with Phase("scheduler poll bursts") as phase:
+            published = {}
+            delivered = set()
+            for burst in range(args.bursts):
+                for channel_id in random.sample(channel_ids, min(args.burst_size, len(channel_ids))):
+                    video_id = stand_ins.upload(feeds_app, channel_id, f"{channel_id[-6:]}-b{burst}")
+                    published[f"https://www.youtube.com/watch?v={video_id}"] = time.monotonic()
+                live = set(random.sample(usernames, min(args.live_per_burst, len(usernames))))
+                for username in live - twitch_app["live_usernames"]:
+                    published[f"https://twitch.tv/{username}"] = time.monotonic()
+                twitch_app["live_usernames"].clear()
+                twitch_app["live_usernames"].update(live)
+                await poll_sources(main.scheduler)
+                collect_latencies(phase, sink_app, published, delivered)
+                if args.burst_interval:
+                    await asyncio.sleep(args.burst_interval)
+            phase.missed = len(published.keys() - delivered)
+        results.append({**phase.result(), "missed": phase.missed})
+
+        with Phase("telegram news") as phase:
+            published = {}
+            delivered = set()
+            semaphore = asyncio.Semaphore(args.news_concurrency)
+
+            async def post_news(session, i):
+                title = f"News {i}"
+                async with semaphore:
+                    published[title] = time.monotonic()
+                    async with session.post(f"{news_url}/news", json={"message": title, "video_url": f"https://www.youtube.com/watch?v=news{i}"}) as resp:
+                        await resp.read()
+
+            async with aiohttp.ClientSession() as session:
+                await asyncio.gather(*(post_news(session, i) for i in range(args.news)))
+            collect_latencies(phase, sink_app, published, delivered)
+        results.append(phase.result())
+
+        twitch_app["live_usernames"].clear()
+        await main.poll_twitch()
+        main.live_updater.interval = 0
+        with Phase("live updates") as phase:
+            streamers = usernames[:max(1, args.live_per_burst)]
+            edits_before = len(sink_app["edits"])
+            twitch_app["live_usernames"].update(streamers)
+            await main.poll_twitch()
+            for round_number in range(args.live_rounds):
+                for username in streamers[::2]:
+                    twitch_app["titles"][username] = f"{username} round {round_number}"
+                await main.poll_twitch()
+                await main.poll_twitch()
+            twitch_app["live_usernames"].clear()
+            await main.poll_twitch()
+            phase.events = len(sink_app["edits"]) - edits_before
+        results.append({**phase.result(), "streams": len(streamers), "polls": args.live_rounds * 2 + 2})
+    finally:
+        await main.dispatcher.stop()
+        main.state_store.close()
+        main.shutdown_executors()
+        await main.http_session.close()
+        await sink_session.close()
+        for runner in runners:
+            await runner.cleanup()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        tracemalloc.stop()
+    return results
+
+
+def print_report(results: list[dict]):
+    columns = ["phase", "events", "seconds", "throughput", "p50_ms", "p99_ms", "memory_mib", "peak_mib"]
+    widths = {column: max(len(column), *(len(str(result.get(column, ""))) for result in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print("  ".join(str(result.get(column, "")).ljust(widths[column]) for column in columns))
+    for result in results:
+        if result.get("streams"):
+            print(f"{result['phase']}: {result['events']} edits for {result['streams']} streams over {result['polls']} polls", file=sys.stderr)
+        if result.get("missed"):
+            print(f"{result['phase']}: {result['missed']} events were never posted", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against local stand-ins for YouTube, Twitch and Discord")
+    parser.add_argument("--sources", type=int, default=1000, help="Number of YouTube feeds")
+    parser.add_argument("--streamers", type=int, default=100, help="Number of Twitch streamers")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=50, help="Uploads published per burst")
+    parser.add_argument("--live-per-burst", type=int, default=5, help="Streamers live during each burst")
+    parser.add_argument("--burst-interval", type=float, default=0.0)
+    parser.add_argument("--targets", type=int, default=1, help="Discord channels every announcement is fanned out to")
+    parser.add_argument("--live-rounds", type=int, default=5, help="Title changes per live stream in the live updates phase")
+    parser.add_argument("--news", type=int, default=200, help="Telegram news requests")
+    parser.add_argument("--news-concurrency", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10, help="RSS_FETCH_CONCURRENCY for the run")
+    parser.add_argument("--channel-rate", type=float, default=1000, help="Discord sends per second allowed per channel")
+    parser.add_argument("--feed-latency", type=float, default=0.02)
+    parser.add_argument("--thumbnail-latency", type=float, default=0.01)
+    parser.add_argument("--missing-maxres", type=float, default=0.2, help="Share of videos without a maxres thumbnail")
+    parser.add_argument("--twitch-latency", type=float, default=0.05)
+    parser.add_argument("--discord-latency", type=float, default=0.03)
+    parser.add_argument("--delivery", choices=["gateway", "webhook"], default="gateway", help="Post through channel.send or through webhooks")
+    parser.add_argument("--webhook-rate", type=int, default=0, help="Webhook requests allowed per window (default: --channel-rate)")
+    parser.add_argument("--webhook-per", type=float, default=1.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth Discord request with 429")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc, which slows the run down noticeably")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
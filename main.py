@@ -1,50 +1,147 @@
+import io
 import os
+import sys
 import json
+import time
+import random
+import itertools
+import hmac
+import hashlib
+import socket
+import sqlite3
+import tempfile
 import asyncio
 import logging
+import logging.handlers
 import threading
+import traceback
+import queue
+import atexit
+import secrets
+import importlib
+import contextlib
+import signal
 from urllib.parse import urlparse, parse_qs
+from xml.etree import ElementTree
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
 from concurrent.futures import ThreadPoolExecutor
-import disnake
-from disnake.ext import commands, tasks
-from disnake.ui import Button, View
-import aiohttp
-import feedparser
-import streamlink
-from aiohttp import web
-from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.memory import MemoryStorage
+from zoneinfo import ZoneInfo
 import datetime as dt
-import pytz
 
 
-TIMEZONE = pytz.timezone('Europe/Moscow')
+STARTUP_STARTED = time.perf_counter()
+PROFILE_STARTUP = "--profile-startup" in sys.argv or os.getenv("PROFILE_STARTUP", "0") == "1"
+startup_timings = []
+
+
+@contextlib.contextmanager
+def startup_step(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings.append((name, time.perf_counter() - started))
+
+
+class LazyModule:
+    def __init__(self, name: str):
+        self.name = name
+        self.module = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.module is None:
+                with startup_step(f"import {self.name} (lazy)"):
+                    self.module = importlib.import_module(self.name)
+                if PROFILE_STARTUP:
+                    logger.info(f"Модуль {self.name} загружен по требованию за {startup_timings[-1][1] * 1000:.1f} мс")
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.module or self.load(), attr)
+
+
+with startup_step("import disnake"):
+    import disnake
+    from disnake.ext import commands, tasks
+    from disnake.ui import Button
+with startup_step("import aiohttp"):
+    import aiohttp
+with startup_step("import dotenv"):
+    from dotenv import load_dotenv
+web = LazyModule("aiohttp.web")
+feedparser = LazyModule("feedparser")
+streamlink = LazyModule("streamlink")
+
+
+load_dotenv()
+TIMEZONE = ZoneInfo('Europe/Moscow')
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
 
 
 class TimezoneFormatter(logging.Formatter):
+    def __init__(self, fmt=None, datefmt=None, tz=TIMEZONE):
+        super().__init__(fmt, datefmt)
+        self.tz = tz
+        self.cached_second = None
+        self.cached_time = ""
+
     def formatTime(self, record, datefmt=None):
-        dt_obj = dt.datetime.fromtimestamp(record.created, tz=TIMEZONE)
         if datefmt:
-            return dt_obj.strftime(datefmt)
-        return dt_obj.strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+            return dt.datetime.fromtimestamp(record.created, tz=self.tz).strftime(datefmt)
+        second = int(record.created)
+        if second != self.cached_second:
+            self.cached_time = dt.datetime.fromtimestamp(second, tz=self.tz).strftime('%Y-%m-%d %H:%M:%S')
+            self.cached_second = second
+        return f"{self.cached_time},{int(record.msecs):03d}"
+
+
+class JsonFormatter(TimezoneFormatter):
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
 
 
-logging.basicConfig(
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TimezoneFormatter('%(asctime)s [%(levelname)s] %(message)s'))
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(level=LOG_LEVEL, handlers=[LogQueueHandler(log_queue)], force=True)
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 
-for handler in logger.handlers:
-    handler.setFormatter(TimezoneFormatter('%(asctime)s [%(levelname)s] %(message)s'))
+log_listener = setup_logging()
+logger = logging.getLogger(__name__)
 
 
-STATE_FILE = "youtube_state.json"
+PRIORITY_LIVE = 0
+PRIORITY_VIDEO = 1
+PRIORITY_NEWS = 2
+PRIORITY_EDIT = 3
 TEMP_IMAGE_DIR = "temp_images"
 START_MESSAGE = "Управление уведомлениями в Discord"
 TITLE_PROMPT = "1. Введите название сообщения:"
@@ -64,7 +161,42 @@ WEB_SERVER_ERROR = "Ошибка сервера"
 DISCORD_CHANNEL_ERROR = "Discord канал не найден"
 
 
-load_dotenv()
+def env_flag(name: str, default: bool = True) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off", "")
+
+
+ENABLE_TELEGRAM = env_flag("ENABLE_TELEGRAM")
+ENABLE_TWITCH = env_flag("ENABLE_TWITCH")
+ENABLE_WEBSERVER = env_flag("ENABLE_WEBSERVER")
+DISCORD_GATEWAY = env_flag("DISCORD_GATEWAY")
+DELIVERY_BACKEND = os.getenv("DELIVERY_BACKEND", "gateway")
+WEBHOOKS_FILE = os.getenv("WEBHOOKS_FILE", "webhooks.json")
+STATE_FILE = os.getenv("STATE_FILE", "youtube_state.json")
+STATE_DB = os.getenv("STATE_DB", "bot_state.sqlite3")
+STATE_BACKEND = os.getenv("STATE_BACKEND", "json")
+STATE_FLUSH_DELAY = float(os.getenv("STATE_FLUSH_DELAY", "1"))
+STATE_FLUSH_MAX_DELAY = float(os.getenv("STATE_FLUSH_MAX_DELAY", "300"))
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "none")
+COORDINATION_MODE = os.getenv("COORDINATION_MODE", "leader")
+COORDINATION_DB = os.getenv("COORDINATION_DB", "coordination.sqlite3")
+COORDINATION_DIR = os.getenv("COORDINATION_DIR", "coordination")
+COORDINATION_TTL = float(os.getenv("COORDINATION_TTL", "30"))
+EVENT_CLAIM_TTL = float(os.getenv("EVENT_CLAIM_TTL", "120"))
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "7"))
+DISCORD_CHANNEL_RATE = float(os.getenv("DISCORD_CHANNEL_RATE", "5"))
+DISCORD_CHANNEL_PER = float(os.getenv("DISCORD_CHANNEL_PER", "5"))
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "10"))
+DISCORD_GLOBAL_RATE = float(os.getenv("DISCORD_GLOBAL_RATE", "50"))
+DISPATCH_MAX_RETRIES = int(os.getenv("DISPATCH_MAX_RETRIES", "3"))
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", "1000"))
+PREVIEW_MEMORY_LIMIT = int(os.getenv("PREVIEW_MEMORY_LIMIT", str(32 * 1024 * 1024)))
+PREVIEW_SPILL_BYTES = int(os.getenv("PREVIEW_SPILL_BYTES", str(5 * 1024 * 1024)))
+PREVIEW_ORPHAN_TTL = int(os.getenv("PREVIEW_ORPHAN_TTL", "3600"))
+TEMPLATES_FILE = os.getenv("TEMPLATES_FILE", "templates.json")
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_ADMIN_ID = int(os.getenv("TELEGRAM_ADMIN_ID", "0"))
@@ -72,18 +204,1597 @@ PORT = int(os.getenv("PORT", "8000"))
 YOUTUBE_CHANNEL_ID = int(os.getenv("YOUTUBE_CHANNEL_ID", "1374412160939196476"))
 TWITCH_CHANNEL_ID = int(os.getenv("TWITCH_CHANNEL_ID", "1374434150395940965"))
 YOUTUBE_CHANNEL_RSS = os.getenv("YOUTUBE_CHANNEL_RSS", "https://www.youtube.com/feeds/videos.xml?channel_id=UCGCE6j2NovYuhXIMlCPhHnQ")
+YOUTUBE_TARGET_CHANNEL_IDS = [int(channel_id) for channel_id in os.getenv("YOUTUBE_TARGET_CHANNEL_IDS", str(YOUTUBE_CHANNEL_ID)).split(",") if channel_id.strip()]
+TWITCH_TARGET_CHANNEL_IDS = [int(channel_id) for channel_id in os.getenv("TWITCH_TARGET_CHANNEL_IDS", str(TWITCH_CHANNEL_ID)).split(",") if channel_id.strip()]
+NEWS_TARGET_CHANNEL_IDS = [int(channel_id) for channel_id in os.getenv("NEWS_TARGET_CHANNEL_IDS", str(YOUTUBE_CHANNEL_ID)).split(",") if channel_id.strip()]
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "50"))
+DELIVERY_LOG_LIMIT = int(os.getenv("DELIVERY_LOG_LIMIT", "100"))
+YOUTUBE_FEEDS = [url.strip() for url in os.getenv("YOUTUBE_FEEDS", YOUTUBE_CHANNEL_RSS).split(",") if url.strip()]
+RSS_FETCH_CONCURRENCY = int(os.getenv("RSS_FETCH_CONCURRENCY", "10"))
+RSS_PARSE_WORKERS = int(os.getenv("RSS_PARSE_WORKERS", "2"))
+RSS_PARSE_OFFLOAD_BYTES = int(os.getenv("RSS_PARSE_OFFLOAD_BYTES", "65536"))
+SEEN_VIDEOS_LIMIT = int(os.getenv("SEEN_VIDEOS_LIMIT", "500"))
+THUMBNAIL_CACHE_SIZE = int(os.getenv("THUMBNAIL_CACHE_SIZE", "1024"))
+THUMBNAIL_CACHE_TTL = int(os.getenv("THUMBNAIL_CACHE_TTL", "3600"))
+THUMBNAIL_NEGATIVE_TTL = int(os.getenv("THUMBNAIL_NEGATIVE_TTL", "300"))
+YOUTUBE_THUMBNAIL_URL = os.getenv("YOUTUBE_THUMBNAIL_URL", "https://img.youtube.com/vi/{video_id}/{quality}.jpg")
+PENDING_CONFIRM_LIMIT = int(os.getenv("PENDING_CONFIRM_LIMIT", "100"))
+PENDING_CONFIRM_TTL = int(os.getenv("PENDING_CONFIRM_TTL", "3600"))
 TWITCH_USERNAME = os.getenv("TWITCH_USERNAME", "xKamysh")
+TWITCH_USERNAMES = [name.strip() for name in os.getenv("TWITCH_USERNAMES", TWITCH_USERNAME).split(",") if name.strip()] if ENABLE_TWITCH else []
+TWITCH_CHECK_WORKERS = int(os.getenv("TWITCH_CHECK_WORKERS", "8"))
+TWITCH_CHECK_TIMEOUT = float(os.getenv("TWITCH_CHECK_TIMEOUT", "20"))
+TWITCH_LIVENESS_BACKEND = os.getenv("TWITCH_LIVENESS_BACKEND", "helix")
+TWITCH_CLIENT_ID = os.getenv("TWITCH_CLIENT_ID", "")
+TWITCH_CLIENT_SECRET = os.getenv("TWITCH_CLIENT_SECRET", "")
+TWITCH_HELIX_URL = os.getenv("TWITCH_HELIX_URL", "https://api.twitch.tv/helix")
+TWITCH_TOKEN_URL = os.getenv("TWITCH_TOKEN_URL", "https://id.twitch.tv/oauth2/token")
+TWITCH_HELIX_BATCH_SIZE = min(int(os.getenv("TWITCH_HELIX_BATCH_SIZE", "100")), 100)
+# GQL — внутренний недокументированный API сайта Twitch, может сломаться без предупреждения; только по TWITCH_LIVENESS_BACKEND=gql
+TWITCH_GQL_URL = os.getenv("TWITCH_GQL_URL", "https://gql.twitch.tv/gql")
+TWITCH_GQL_CLIENT_ID = os.getenv("TWITCH_GQL_CLIENT_ID", "")
+TWITCH_GQL_BATCH_SIZE = int(os.getenv("TWITCH_GQL_BATCH_SIZE", "35"))
+TWITCH_GQL_STREAM_FIELDS = "id title createdAt viewersCount game { displayName } previewImageURL(width: 1280, height: 720)"
+LIVE_EDIT_INTERVAL = float(os.getenv("LIVE_EDIT_INTERVAL", "120"))
+LIVE_THUMBNAIL_REFRESH = float(os.getenv("LIVE_THUMBNAIL_REFRESH", "900"))
 CHECK_INTERVAL_MINUTES = int(os.getenv("CHECK_INTERVAL_MINUTES", "5"))
+POLL_MIN_SECONDS = float(os.getenv("POLL_MIN_SECONDS", str(CHECK_INTERVAL_MINUTES * 60 / 5)))
+POLL_MAX_SECONDS = float(os.getenv("POLL_MAX_SECONDS", str(CHECK_INTERVAL_MINUTES * 60 * 2)))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "1.25"))
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.1"))
+POLL_HOT_WINDOW_HOURS = int(os.getenv("POLL_HOT_WINDOW_HOURS", "1"))
+POLL_HOT_MIN_EVENTS = int(os.getenv("POLL_HOT_MIN_EVENTS", "2"))
+POLL_HOT_MAX_SHARE = float(os.getenv("POLL_HOT_MAX_SHARE", "0.1"))
+POLL_ACTIVITY_HISTORY = int(os.getenv("POLL_ACTIVITY_HISTORY", "50"))
+WEBSUB_CALLBACK_URL = os.getenv("WEBSUB_CALLBACK_URL", "")
+WEBSUB_HUB_URL = os.getenv("WEBSUB_HUB_URL", "https://pubsubhubbub.appspot.com/subscribe")
+WEBSUB_SECRET = os.getenv("WEBSUB_SECRET", "")
+WEBSUB_LEASE_SECONDS = int(os.getenv("WEBSUB_LEASE_SECONDS", "432000"))
+WEBSUB_RECONCILE_MINUTES = int(os.getenv("WEBSUB_RECONCILE_MINUTES", "60"))
+WEBSUB_MAX_VIDEO_AGE_HOURS = float(os.getenv("WEBSUB_MAX_VIDEO_AGE_HOURS", "48"))
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "120"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+RSS_FETCH_TIMEOUT = float(os.getenv("RSS_FETCH_TIMEOUT", "10"))
+THUMBNAIL_PROBE_TIMEOUT = float(os.getenv("THUMBNAIL_PROBE_TIMEOUT", "5"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "15"))
+WEBSUB_TIMEOUT = float(os.getenv("WEBSUB_TIMEOUT", "10"))
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "0.25"))
+WATCHDOG_THRESHOLD = float(os.getenv("WATCHDOG_THRESHOLD", "0.5"))
+WATCHDOG_STACK_DEPTH = int(os.getenv("WATCHDOG_STACK_DEPTH", "30"))
+WATCHDOG_HISTORY = int(os.getenv("WATCHDOG_HISTORY", "20"))
+HEALTH_STALL_WINDOW = float(os.getenv("HEALTH_STALL_WINDOW", "300"))
+SUPERVISOR_RESTART_DELAY = float(os.getenv("SUPERVISOR_RESTART_DELAY", "5"))
+SUPERVISOR_RESTART_MAX_DELAY = float(os.getenv("SUPERVISOR_RESTART_MAX_DELAY", "300"))
+
+
+class SeenVideoIndex:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.sources: dict[str, OrderedDict] = {}
+
+    def has_source(self, source: str) -> bool:
+        return source in self.sources
+
+    def is_seen(self, source: str, video_id: str) -> bool:
+        return video_id in self.sources.get(source, ())
+
+    def add(self, source: str, video_id: str):
+        seen = self.sources.setdefault(source, OrderedDict())
+        seen[video_id] = None
+        seen.move_to_end(video_id)
+        while len(seen) > self.limit:
+            seen.popitem(last=False)
+
+    def load(self, data: dict):
+        for source, video_ids in data.items():
+            for video_id in video_ids:
+                self.add(source, video_id)
+
+    def to_dict(self) -> dict:
+        return {source: list(seen) for source, seen in self.sources.items()}
+
+
+class FeedEntry(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class YouTubeFeed:
+    def __init__(self, entries: list, self_url: str = "", complete: bool = True):
+        self.entries = entries
+        self.self_url = self_url
+        self.complete = complete
+
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+YT_NS = "{http://www.youtube.com/xml/schemas/2015}"
+FEED_PARSE_CHUNK = 16384
+
+
+def parse_published(published: str):
+    try:
+        return dt.datetime.fromisoformat(published).utctimetuple()
+    except ValueError:
+        return None
+
+
+def parse_youtube_feed(body: bytes, is_known=None) -> YouTubeFeed:
+    parser = ElementTree.XMLPullParser(events=("end",))
+    entries = []
+    self_url = ""
+    for offset in range(0, len(body), FEED_PARSE_CHUNK):
+        parser.feed(body[offset:offset + FEED_PARSE_CHUNK])
+        for _, element in parser.read_events():
+            if element.tag == ATOM_NS + "link" and element.get("rel") == "self":
+                self_url = element.get("href", "")
+            elif element.tag == ATOM_NS + "entry":
+                video_id = element.findtext(YT_NS + "videoId")
+                link = next((link.get("href") for link in element.iterfind(ATOM_NS + "link") if link.get("rel", "alternate") == "alternate"), None)
+                if not video_id or not link:
+                    raise ValueError("запись без yt:videoId или ссылки")
+                if is_known and is_known(video_id):
+                    return YouTubeFeed(entries, self_url, complete=False)
+                published = element.findtext(ATOM_NS + "published") or ""
+                entries.append(FeedEntry(
+                    video_id=video_id,
+                    title=element.findtext(ATOM_NS + "title") or "",
+                    link=link,
+                    published=published,
+                    published_parsed=parse_published(published)
+                ))
+                element.clear()
+    parser.close()
+    return YouTubeFeed(entries, self_url)
+
+
+def parse_feed_body(body: bytes, is_known=None) -> YouTubeFeed:
+    try:
+        return parse_youtube_feed(body, is_known)
+    except (ElementTree.ParseError, ValueError) as e:
+        logger.warning(f"Потоковый разбор ленты не удался ({e}), используется feedparser")
+    feed = feedparser.parse(body)
+    self_url = next((link.href for link in feed.feed.get("links", []) if link.get("rel") == "self"), "")
+    return YouTubeFeed(feed.entries, self_url)
+
+
+class TTLCache:
+    MISSING = object()
+
+    def __init__(self, maxsize: int, ttl: float, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.data: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expiries = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        removed = []
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self.data[key]
+                self.misses += 1
+                self.expiries += 1
+                removed.append((key, value, "expired"))
+                value = default
+            else:
+                self.data.move_to_end(key)
+                self.hits += 1
+        self.notify(removed)
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        removed = []
+        now = time.monotonic()
+        with self.lock:
+            self.data[key] = (now + (self.ttl if ttl is None else ttl), value)
+            self.data.move_to_end(key)
+            while self.data:
+                head_key, (expires_at, head_value) = next(iter(self.data.items()))
+                if expires_at > now:
+                    break
+                del self.data[head_key]
+                self.expiries += 1
+                removed.append((head_key, head_value, "expired"))
+            while len(self.data) > self.maxsize:
+                head_key, (_, head_value) = self.data.popitem(last=False)
+                self.evictions += 1
+                removed.append((head_key, head_value, "evicted"))
+        self.notify(removed)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.data.pop(key, None)
+        return default if item is None else item[1]
+
+    def notify(self, removed: list):
+        if not self.on_evict:
+            return
+        for key, value, reason in removed:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика вытеснения кэша для {key}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expiries": self.expiries,
+            "evictions": self.evictions
+        }
+
+    def __len__(self):
+        return len(self.data)
+
+
+class StateStore:
+    def __init__(self, flush_delay: float = STATE_FLUSH_DELAY, max_delay: float = STATE_FLUSH_MAX_DELAY):
+        self.flush_delay = flush_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.data = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.loop = None
+        self.flush_task = None
+
+    def load(self) -> dict:
+        self.data = self.read_all()
+        return dict(self.data)
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    async def get(self, key: str, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    async def put(self, key: str, value):
+        self.put_many({key: value})
+
+    def put_many(self, items: dict):
+        with self.lock:
+            self.data.update(items)
+            self.dirty.update(items)
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self.loop.call_soon_threadsafe(self.schedule_flush)
+
+    def schedule_flush(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = self.loop.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(min(self.flush_delay * 2 ** self.failures, self.max_delay))
+        await self.flush()
+
+    async def flush(self):
+        taken = self.take_snapshot()
+        if taken is None:
+            return
+        keys, snapshot = taken
+        if await asyncio.to_thread(self.write_snapshot, snapshot):
+            self.failures = 0
+            return
+        self.restore_dirty(keys)
+        self.failures += 1
+        self.loop.call_soon(self.schedule_flush)
+
+    def take_snapshot(self):
+        with self.lock:
+            if not self.dirty:
+                return None
+            keys = self.dirty
+            snapshot = self.snapshot(keys)
+            self.dirty = set()
+        return keys, snapshot
+
+    def restore_dirty(self, keys: set):
+        with self.lock:
+            self.dirty |= keys
+
+    def write_snapshot(self, snapshot) -> bool:
+        try:
+            with self.write_lock:
+                self.write(snapshot)
+            logger.debug("Состояние сохранено (%s)", self.__class__.__name__)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния: {e}")
+            return False
+
+    def close(self):
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+        taken = self.take_snapshot()
+        if taken is not None and not self.write_snapshot(taken[1]):
+            self.restore_dirty(taken[0])
+
+    def read_all(self) -> dict:
+        raise NotImplementedError
+
+    def snapshot(self, keys: set):
+        raise NotImplementedError
+
+    def write(self, snapshot):
+        raise NotImplementedError
+
+
+class JsonStateStore(StateStore):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def read_all(self) -> dict:
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def snapshot(self, keys: set) -> dict:
+        return dict(self.data)
+
+    def write(self, snapshot: dict):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".state-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class SqliteStateStore(StateStore):
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def read_all(self) -> dict:
+        with self.write_lock:
+            rows = self.conn.execute("SELECT key, value FROM state").fetchall()
+        if not rows and os.path.exists(STATE_FILE):
+            logger.info(f"Перенос состояния из {STATE_FILE} в {self.path}")
+            data = JsonStateStore(STATE_FILE).read_all()
+            self.write(data)
+            return data
+        return {key: json.loads(value) for key, value in rows}
+
+    def snapshot(self, keys: set) -> dict:
+        return {key: self.data[key] for key in keys}
+
+    def write(self, snapshot: dict):
+        rows = [(key, json.dumps(value)) for key, value in snapshot.items()]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", rows)
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+
+POLLER_LEASE = "poller"
+
+
+class Coordinator:
+    name = "none"
+    shared = False
+
+    def __init__(self, instance_id: str = INSTANCE_ID, mode: str = COORDINATION_MODE, ttl: float = COORDINATION_TTL):
+        self.instance_id = instance_id
+        self.mode = mode
+        self.ttl = ttl
+        self.leader = not self.shared
+        self.members = [instance_id]
+        self.valid_until = 0.0
+        self.changed_at = time.time()
+        self.lock = threading.Lock()
+        self.state = {"leases": {}, "members": {}, "events": {}}
+
+    def owns(self, source_id: str) -> bool:
+        if self.mode == "leader":
+            return self.leader
+        return max(self.members, key=lambda member: hashlib.blake2b(f"{member}:{source_id}".encode(), digest_size=8).digest()) == self.instance_id
+
+    async def refresh(self) -> bool:
+        now = time.time()
+        try:
+            leader, members = await asyncio.to_thread(self.sync, now)
+            self.valid_until = now + self.ttl
+        except Exception as e:
+            logger.warning("Ошибка координации (%s): %s", self.name, e)
+            if self.mode != "leader" or time.time() < self.valid_until:
+                return False
+            leader, members = False, self.members
+        changed = leader != self.leader or members != self.members
+        if changed and self.shared:
+            self.changed_at = now
+            if self.mode == "leader":
+                logger.log(logging.INFO if leader else logging.WARNING, "Экземпляр %s %s ведущим опросчиком", self.instance_id, "стал" if leader else "больше не является")
+            else:
+                logger.info("Участники координации: %s", ", ".join(members))
+        self.leader, self.members = leader, members
+        return changed
+
+    def takeover_since(self) -> float | None:
+        if not self.shared:
+            return None
+        poll_interval = max(POLL_MAX_SECONDS, WEBSUB_RECONCILE_MINUTES * 60 if WEBSUB_CALLBACK_URL else 0)
+        return self.changed_at - self.ttl - poll_interval
+
+    async def claim_events(self, keys: list[str]) -> set[str]:
+        try:
+            return await asyncio.to_thread(self.claim, keys, time.time(), EVENT_CLAIM_TTL)
+        except Exception as e:
+            logger.warning("Не удалось захватить события (%s): %s", self.name, e)
+            return set(keys)
+
+    async def settle_events(self, done: list[str], failed: list[str]):
+        try:
+            await asyncio.to_thread(self.settle, done, failed, time.time())
+        except Exception as e:
+            logger.warning("Не удалось сохранить статус событий (%s): %s", self.name, e)
+
+    def sync(self, now: float) -> tuple[bool, list[str]]:
+        self.prune(now)
+        if self.mode == "leader":
+            return self.try_lease(POLLER_LEASE, now), [self.instance_id]
+        return True, self.heartbeat(now)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            yield self.state
+
+    def try_lease(self, name: str, now: float) -> bool:
+        with self.transaction() as state:
+            lease = state["leases"].get(name)
+            if lease and lease["holder"] != self.instance_id and lease["expires_at"] > now:
+                return False
+            state["leases"][name] = {"holder": self.instance_id, "expires_at": now + self.ttl}
+            return True
+
+    def heartbeat(self, now: float) -> list[str]:
+        with self.transaction() as state:
+            state["members"][self.instance_id] = {"expires_at": now + self.ttl}
+            return sorted(member for member, entry in state["members"].items() if entry["expires_at"] > now)
+
+    def claim(self, keys: list[str], now: float, ttl: float) -> set[str]:
+        claimed = set()
+        with self.transaction() as state:
+            for key in keys:
+                event = state["events"].get(key)
+                if event and event["expires_at"] > now:
+                    continue
+                state["events"][key] = {"holder": self.instance_id, "status": "pending", "expires_at": now + ttl}
+                claimed.add(key)
+        return claimed
+
+    def settle(self, done: list[str], failed: list[str], now: float):
+        with self.transaction() as state:
+            for key in done + failed:
+                event = state["events"].get(key)
+                if not event or event["holder"] != self.instance_id:
+                    continue
+                if key in done:
+                    state["events"][key] = {"holder": self.instance_id, "status": "done", "expires_at": now + EVENT_RETENTION_DAYS * 86400}
+                elif event["status"] == "pending":
+                    del state["events"][key]
+
+    def prune(self, now: float):
+        with self.transaction() as state:
+            for table in state.values():
+                for key in [key for key, entry in table.items() if entry["expires_at"] <= now]:
+                    del table[key]
+
+    def leave(self):
+        with self.transaction() as state:
+            state["members"].pop(self.instance_id, None)
+            lease = state["leases"].get(POLLER_LEASE)
+            if lease and lease["holder"] == self.instance_id:
+                del state["leases"][POLLER_LEASE]
+
+    def close(self):
+        try:
+            self.leave()
+        except Exception as e:
+            logger.warning("Ошибка выхода из координации (%s): %s", self.name, e)
+
+
+class FileCoordinator(Coordinator):
+    name = "file"
+    shared = True
+
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "coordination.json")
+        self.lock_path = os.path.join(directory, "coordination.lock")
+
+    @contextlib.contextmanager
+    def transaction(self):
+        import fcntl
+        with self.lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path, "r") as f:
+                    state = json.load(f)
+            except FileNotFoundError:
+                state = {"leases": {}, "members": {}, "events": {}}
+            yield state
+            JsonStateStore(self.path).write(state)
+
+
+class SqliteCoordinator(Coordinator):
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.conn = sqlite3.connect(path, timeout=self.ttl / 3, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS members (instance_id TEXT PRIMARY KEY, expires_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS events (key TEXT PRIMARY KEY, holder TEXT NOT NULL, status TEXT NOT NULL, expires_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS events_expires_at ON events (expires_at);"
+        )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def try_lease(self, name: str, now: float) -> bool:
+        with self.transaction() as conn:
+            row = conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != self.instance_id and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)", (name, self.instance_id, now + self.ttl))
+            return True
+
+    def heartbeat(self, now: float) -> list[str]:
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO members (instance_id, expires_at) VALUES (?, ?)", (self.instance_id, now + self.ttl))
+            return [row[0] for row in conn.execute("SELECT instance_id FROM members WHERE expires_at > ? ORDER BY instance_id", (now,))]
+
+    def claim(self, keys: list[str], now: float, ttl: float) -> set[str]:
+        claimed = set()
+        with self.transaction() as conn:
+            for key in keys:
+                row = conn.execute("SELECT expires_at FROM events WHERE key = ?", (key,)).fetchone()
+                if row and row[0] > now:
+                    continue
+                conn.execute("INSERT OR REPLACE INTO events (key, holder, status, expires_at) VALUES (?, ?, 'pending', ?)", (key, self.instance_id, now + ttl))
+                claimed.add(key)
+        return claimed
+
+    def settle(self, done: list[str], failed: list[str], now: float):
+        with self.transaction() as conn:
+            expires_at = now + EVENT_RETENTION_DAYS * 86400
+            conn.executemany("UPDATE events SET status = 'done', expires_at = ? WHERE key = ? AND holder = ?", [(expires_at, key, self.instance_id) for key in done])
+            conn.executemany("DELETE FROM events WHERE key = ? AND holder = ? AND status = 'pending'", [(key, self.instance_id) for key in failed])
+
+    def prune(self, now: float):
+        with self.transaction() as conn:
+            for table in ("leases", "members", "events"):
+                conn.execute(f"DELETE FROM {table} WHERE expires_at <= ?", (now,))
+
+    def leave(self):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM members WHERE instance_id = ?", (self.instance_id,))
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (POLLER_LEASE, self.instance_id))
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, per: float):
+        self.capacity = rate
+        self.tokens = rate
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+
+    def acquire(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.fill_rate
+
+    def release(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def penalize(self, delay: float):
+        self.tokens = min(self.tokens, 1 - delay * self.fill_rate)
+        self.updated = time.monotonic()
+
+
+@dataclass(order=True)
+class DispatchJob:
+    priority: int
+    sequence: int
+    channel: object = field(compare=False)
+    kwargs: dict = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    attempt: int = field(default=0, compare=False)
+    message_id: int | None = field(default=None, compare=False)
+
+
+class DiscordDispatcher:
+    def __init__(self, workers: int = DISPATCH_WORKERS, max_retries: int = DISPATCH_MAX_RETRIES, maxsize: int = DISPATCH_QUEUE_SIZE):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.maxsize = maxsize
+        self.queue = None
+        self.slots = None
+        self.tasks = []
+        self.buckets = {}
+        self.global_bucket = TokenBucket(DISCORD_GLOBAL_RATE, 1)
+        self.pending = 0
+        self.sequence = itertools.count()
+        self.metrics = {"enqueued": 0, "sent": 0, "retried": 0, "failed": 0, "max_depth": 0, "wait_seconds": 0.0}
+
+    def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.slots = asyncio.Semaphore(self.maxsize)
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def depth(self) -> int:
+        return self.pending
+
+    def stats(self) -> dict:
+        return {**self.metrics, "depth": self.depth()}
+
+    async def send(self, channel, priority: int = PRIORITY_NEWS, **kwargs):
+        return await self.submit(channel, priority, kwargs)
+
+    async def edit(self, channel, message_id: int, priority: int = PRIORITY_EDIT, **kwargs):
+        return await self.submit(channel, priority, kwargs, message_id)
+
+    async def submit(self, channel, priority: int, kwargs: dict, message_id: int | None = None):
+        await self.slots.acquire()
+        self.pending += 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            self.queue.put_nowait(DispatchJob(priority, next(self.sequence), channel, kwargs, future, time.monotonic(), message_id=message_id))
+            self.metrics["enqueued"] += 1
+            self.metrics["max_depth"] = max(self.metrics["max_depth"], self.pending)
+            if self.pending > self.maxsize // 2:
+                logger.warning("Очередь отправки в Discord заполнена: %d/%d", self.pending, self.maxsize)
+            return await future
+        finally:
+            self.pending -= 1
+            self.slots.release()
+
+    def requeue_later(self, job: DispatchJob, delay: float):
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, job)
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.future.done():
+                    continue
+                bucket = self.buckets.setdefault(job.channel.id, TokenBucket(DISCORD_CHANNEL_RATE, DISCORD_CHANNEL_PER))
+                delay = bucket.acquire()
+                if not delay:
+                    delay = self.global_bucket.acquire()
+                    if delay:
+                        bucket.release()
+                if delay:
+                    self.requeue_later(job, delay)
+                    continue
+                await self.deliver(job)
+            finally:
+                self.queue.task_done()
+
+    async def deliver(self, job: DispatchJob):
+        try:
+            with DISCORD_SEND_SECONDS.time():
+                message = await self.call(job)
+        except Exception as e:
+            retry_after = self.retry_delay(job, e)
+            if retry_after is None:
+                self.metrics["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            self.metrics["retried"] += 1
+            job.attempt += 1
+            for file in job.kwargs.get("files") or ():
+                file.reset()
+            self.requeue_later(job, retry_after)
+            return
+        reset_after = job.channel.rate_limit_delay() if hasattr(job.channel, "rate_limit_delay") else 0
+        if reset_after:
+            self.buckets[job.channel.id].penalize(reset_after)
+        self.metrics["sent"] += 1
+        self.metrics["wait_seconds"] += time.monotonic() - job.enqueued_at
+        if not job.future.done():
+            job.future.set_result(message)
+
+    @staticmethod
+    async def call(job: DispatchJob):
+        if job.message_id is None:
+            return await job.channel.send(**job.kwargs)
+        if hasattr(job.channel, "edit_message"):
+            return await job.channel.edit_message(job.message_id, **job.kwargs)
+        return await job.channel.get_partial_message(job.message_id).edit(**job.kwargs)
+
+    def retry_delay(self, job: DispatchJob, error: Exception) -> float | None:
+        if job.attempt >= self.max_retries:
+            return None
+        backoff = min(2 ** job.attempt, 30) * random.uniform(0.5, 1.5)
+        if isinstance(error, (disnake.HTTPException, WebhookHTTPError)):
+            if error.status != 429 and error.status < 500:
+                return None
+            if isinstance(error, WebhookHTTPError):
+                retry_after = error.retry_after
+            else:
+                retry_after = float(error.response.headers.get("Retry-After", 0) or 0)
+            if retry_after:
+                bucket = self.global_bucket if getattr(error, "is_global", False) else self.buckets[job.channel.id]
+                bucket.penalize(retry_after)
+            logger.warning("Discord вернул %s для канала %s, повтор %d/%d", error.status, job.channel.id, job.attempt + 1, self.max_retries)
+            return max(backoff, retry_after)
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            logger.warning("Ошибка сети при отправке в канал %s: %s, повтор %d/%d", job.channel.id, error, job.attempt + 1, self.max_retries)
+            return backoff
+        return None
+
+
+class WebhookHTTPError(Exception):
+    def __init__(self, status: int, message: str, retry_after: float = 0.0, is_global: bool = False):
+        super().__init__(f"Webhook вернул {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+        self.is_global = is_global
+
+
+@dataclass
+class WebhookMessage:
+    id: int
+    channel_id: int
+
+
+class WebhookChannel:
+    def __init__(self, channel_id: int, url: str, guild_id: int | None = None):
+        self.id = channel_id
+        self.url = url
+        self.guild = disnake.Object(guild_id) if guild_id else None
+        self.reset_at = 0.0
+
+    def rate_limit_delay(self) -> float:
+        return max(0.0, self.reset_at - time.monotonic())
+
+    @staticmethod
+    def component_rows(components) -> list[dict]:
+        buttons = [component.to_component_dict() for component in components or ()]
+        return [{"type": 1, "components": buttons[i:i + 5]} for i in range(0, len(buttons), 5)]
+
+    async def send(self, content=None, embed=None, components=None, files=None) -> WebhookMessage:
+        payload = {"content": content}
+        if embed is not None:
+            payload["embeds"] = [embed.to_dict()]
+        rows = self.component_rows(components)
+        if rows:
+            payload["components"] = rows
+        if files:
+            payload["attachments"] = [{"id": i, "filename": file.filename} for i, file in enumerate(files)]
+            form = aiohttp.FormData()
+            form.add_field("payload_json", json.dumps(payload), content_type="application/json")
+            for i, file in enumerate(files):
+                form.add_field(f"files[{i}]", file.fp, filename=file.filename)
+            body = {"data": form}
+        else:
+            body = {"json": payload}
+        data = await self.request("POST", self.url, {"wait": "true", "with_components": "true"}, **body)
+        for file in files or ():
+            file.close()
+        return WebhookMessage(int(data["id"]), int(data.get("channel_id") or self.id))
+
+    async def edit_message(self, message_id: int, embed=None) -> WebhookMessage:
+        payload = {"embeds": [embed.to_dict()]} if embed is not None else {}
+        data = await self.request("PATCH", f"{self.url}/messages/{message_id}", {}, json=payload)
+        return WebhookMessage(int(data["id"]), int(data.get("channel_id") or self.id))
+
+    async def request(self, method: str, url: str, params: dict, **body) -> dict:
+        async with http_session.request(method, url, params=params, timeout=http_timeout(WEBHOOK_TIMEOUT), **body) as resp:
+            reset_after = float(resp.headers.get("X-RateLimit-Reset-After", 0) or 0)
+            if resp.headers.get("X-RateLimit-Remaining") == "0":
+                self.reset_at = time.monotonic() + reset_after
+            if resp.status == 429:
+                data = await resp.json(content_type=None)
+                retry_after = float(data.get("retry_after") or resp.headers.get("Retry-After") or reset_after or 1)
+                raise WebhookHTTPError(429, data.get("message", ""), retry_after, bool(data.get("global")) or resp.headers.get("X-RateLimit-Global") == "true")
+            if resp.status >= 400:
+                raise WebhookHTTPError(resp.status, await resp.text(), float(resp.headers.get("Retry-After", 0) or 0))
+            return await resp.json()
+
+
+def load_webhooks(path: str = WEBHOOKS_FILE) -> dict[int, WebhookChannel]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Ошибка загрузки вебхуков {path}: {e}")
+        return {}
+    channels = {}
+    for channel_id, spec in config.items():
+        if isinstance(spec, str):
+            spec = {"url": spec}
+        channels[int(channel_id)] = WebhookChannel(int(channel_id), spec["url"], spec.get("guild_id"))
+    logger.info(f"Вебхуки загружены из {path}: {len(channels)}")
+    return channels
+
+
+@dataclass
+class NewsJob:
+    message: str = ""
+    preview_url: str = ""
+    preview_path: str = ""
+    preview_id: str = ""
+    video_url: str = ""
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NewsJob":
+        return cls(
+            message=data.get("message") or "",
+            preview_url=data.get("preview_url") or "",
+            preview_path=data.get("preview_path") or "",
+            preview_id=data.get("preview_id") or "",
+            video_url=data.get("video_url") or ""
+        )
+
+
+@dataclass
+class NewsDelivery:
+    ok: bool
+    status: int = 200
+    error: str = ""
+
+
+@dataclass
+class TargetDelivery:
+    channel_id: int
+    ok: bool = False
+    message_id: int | None = None
+    error: str = ""
+    seconds: float = 0.0
+    duplicate: bool = False
+
+
+@dataclass
+class FanOutResult:
+    event: str
+    platform: str
+    created_at: float
+    targets: list[TargetDelivery]
+
+    @property
+    def delivered(self) -> int:
+        return sum(1 for target in self.targets if target.ok)
+
+    @property
+    def duplicates(self) -> int:
+        return sum(1 for target in self.targets if target.duplicate)
+
+    def to_dict(self) -> dict:
+        return {
+            "event": self.event,
+            "platform": self.platform,
+            "created_at": self.created_at,
+            "delivered": self.delivered,
+            "duplicates": self.duplicates,
+            "targets": [vars(target) for target in self.targets]
+        }
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+        logger.info(f"Удалён временный файл: {path}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Ошибка при удалении файла {path}: {e}")
+
+
+@dataclass
+class Preview:
+    key: str
+    filename: str
+    data: bytes | None = None
+    path: str | None = None
+    created_at: float = field(default_factory=time.time)
+
+    def telegram_file(self):
+        from aiogram.types import BufferedInputFile, FSInputFile
+        if self.data is not None:
+            return BufferedInputFile(self.data, filename=self.filename)
+        return FSInputFile(self.path, filename=self.filename)
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class PreviewStore:
+    def __init__(self, directory: str, memory_limit: int = PREVIEW_MEMORY_LIMIT, spill_bytes: int = PREVIEW_SPILL_BYTES, ttl: float = PREVIEW_ORPHAN_TTL):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.spill_bytes = spill_bytes
+        self.ttl = ttl
+        self.previews: dict[str, Preview] = {}
+        self.memory_used = 0
+        self.lock = threading.Lock()
+
+    def reserve_memory(self, size: int) -> bool:
+        with self.lock:
+            if size > self.spill_bytes or self.memory_used + size > self.memory_limit:
+                return False
+            self.memory_used += size
+            return True
+
+    def spill_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def add(self, preview: Preview, reserved: int = 0):
+        with self.lock:
+            if preview.data is not None:
+                self.memory_used += len(preview.data) - reserved
+            old = self.previews.pop(preview.key, None)
+            if old and old.data is not None:
+                self.memory_used -= len(old.data)
+            self.previews[preview.key] = preview
+
+    def cancel_reservation(self, size: int):
+        with self.lock:
+            self.memory_used -= size
+
+    def get(self, key: str) -> Preview | None:
+        with self.lock:
+            return self.previews.get(key)
+
+    def release(self, key: str | None):
+        if not key:
+            return
+        with self.lock:
+            preview = self.previews.pop(key, None)
+            if preview and preview.data is not None:
+                self.memory_used -= len(preview.data)
+        if preview and preview.path:
+            remove_file(preview.path)
+
+    def sweep(self) -> int:
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            expired = [key for key, preview in self.previews.items() if preview.created_at < cutoff]
+            referenced = {preview.path for preview in self.previews.values() if preview.path}
+        for key in expired:
+            self.release(key)
+        removed = len(expired)
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.path not in referenced and entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    logger.error(f"Ошибка при удалении файла {entry.path}: {e}")
+        return removed
+
+
+DEFAULT_TEMPLATES = {
+    "embeds": {
+        "youtube": {
+            "content": "@everyone",
+            "title": "✨ Новое видео: {title}",
+            "url": "{link}",
+            "color": [229, 57, 53],
+            "image": "{thumbnail}"
+        },
+        "twitch": {
+            "content": "@everyone",
+            "title": "🔴 {name} сейчас стримит!",
+            "url": "https://twitch.tv/{username}",
+            "description": "🎉 Заходи на эфир! Общение, атмосфера и веселье ждут тебя!",
+            "color": [138, 43, 226],
+            "image": "{image}",
+            "fields": [
+                ["📺 Стрим", "{stream_title}", False],
+                ["🎮 Игра", "{game}", True],
+                ["⏱️ Начало", "{uptime}", True]
+            ],
+            "footer": {"text": "Twitch • {name}", "icon_url": "https://static.twitchcdn.net/assets/favicon-32-e29e246c157142c94346.png"},
+            "defaults": {
+                "image": "https://media.discordapp.net/attachments/722745907279298590/1378720172734545970/134799723_thumbnail.webp?ex=683e4978&is=683cf7f8&hm=199afc43df2a8def8a11ce6bbbe3d7fe79cf3351fa916f1f930428d90a2ca6e2&=&format=webp&width=1522&height=856"
+            }
+        },
+        "twitch_ended": {
+            "title": "⚫ {name} завершил стрим",
+            "url": "https://twitch.tv/{username}",
+            "description": "Спасибо всем, кто был на эфире! Запись и клипы — на канале.",
+            "color": [100, 100, 110],
+            "fields": [
+                ["📺 Стрим", "{stream_title}", False],
+                ["🎮 Игра", "{game}", True],
+                ["⏱️ Длительность", "{duration}", True]
+            ],
+            "footer": {"text": "Twitch • {name}", "icon_url": "https://static.twitchcdn.net/assets/favicon-32-e29e246c157142c94346.png"}
+        },
+        "news": {
+            "content": "@everyone",
+            "title": "{title}",
+            "url": "{url}",
+            "color": [229, 57, 53],
+            "image": "{image}"
+        }
+    },
+    "creators": {},
+    "links": {
+        "default": {
+            "fallback": "https://t.me/kamyshovnik",
+            "buttons": [
+                ["💬 Telegram", "https://t.me/kamyshovnik"],
+                ["📘 VK", "https://vk.com/kamyshovnik"],
+                ["🎵 TikTok", "https://www.tiktok.com/@xkamysh"],
+                ["💖 Boosty", "https://boosty.to/xkamysh"]
+            ]
+        }
+    }
+}
+
+
+class TemplateValues(dict):
+    def __missing__(self, key):
+        return ""
+
+
+class NotificationTemplate:
+    REQUIRED_KEYS = {"image": "url", "thumbnail": "url", "footer": "text", "author": "name"}
+
+    def __init__(self, spec: dict):
+        self.content = spec.get("content")
+        self.defaults = spec.get("defaults", {})
+        self.color = disnake.Color.from_rgb(*spec["color"]).value if spec.get("color") else None
+        self.fields = []
+        for key in ("title", "url", "description"):
+            if spec.get(key):
+                self.fields.append(((key,), spec[key], "{" in spec[key]))
+        for key in ("image", "thumbnail"):
+            if spec.get(key):
+                self.fields.append(((key, "url"), spec[key], "{" in spec[key]))
+        for section in ("footer", "author"):
+            for key, value in spec.get(section, {}).items():
+                self.fields.append(((section, key), value, "{" in value))
+        self.embed_fields = [(name, value, inline) for name, value, inline in spec.get("fields", [])]
+
+    def render(self, creator: dict | None = None, **values) -> disnake.Embed:
+        merged = TemplateValues(self.defaults)
+        merged.update(creator or {})
+        merged.update({key: value for key, value in values.items() if value is not None})
+        data = {"type": "rich", "timestamp": dt.datetime.now(dt.UTC).isoformat()}
+        if self.color is not None:
+            data["color"] = self.color
+        for path, template, dynamic in self.fields:
+            value = template.format_map(merged) if dynamic else template
+            if not value:
+                continue
+            if len(path) == 1:
+                data[path[0]] = value
+            else:
+                data.setdefault(path[0], {})[path[1]] = value
+        for name, template, inline in self.embed_fields:
+            value = template.format_map(merged)
+            if value:
+                data.setdefault("fields", []).append({"name": name.format_map(merged), "value": value, "inline": inline})
+        for section, required in self.REQUIRED_KEYS.items():
+            if section in data and required not in data[section]:
+                del data[section]
+        return disnake.Embed.from_dict(data)
+
+
+class LinkSet:
+    def __init__(self, spec: dict):
+        self.fallback = spec.get("fallback", "")
+        self.buttons = [Button(label=label, url=url, style=disnake.ButtonStyle.link) for label, url in spec.get("buttons", [])]
+        self.fallback_button = Button(label="🔗 Нет ссылки", url=self.fallback, style=disnake.ButtonStyle.link) if self.fallback else None
+
+    def components(self, url: str = "") -> list[Button]:
+        if url:
+            return [Button(label="🔗 Ссылка", url=url, style=disnake.ButtonStyle.link), *self.buttons]
+        if self.fallback_button:
+            return [self.fallback_button, *self.buttons]
+        return list(self.buttons)
+
+
+class NotificationTemplates:
+    def __init__(self, config: dict):
+        self.embeds = {name: NotificationTemplate(spec) for name, spec in config.get("embeds", {}).items()}
+        self.creators = config.get("creators", {})
+        links = config.get("links", {})
+        self.default_links = LinkSet(links.get("default", {}))
+        self.guild_links = {int(guild_id): LinkSet(spec) for guild_id, spec in links.items() if guild_id != "default"}
+
+    def content(self, platform: str) -> str | None:
+        return self.embeds[platform].content
+
+    def render(self, platform: str, creator: str | None = None, **values) -> disnake.Embed:
+        creator_values = {"name": creator, **self.creators.get(creator, {})} if creator else None
+        return self.embeds[platform].render(creator_values, **values)
+
+    def components(self, url: str = "", guild_id: int | None = None) -> list[Button]:
+        return self.guild_links.get(guild_id, self.default_links).components(url)
+
+
+def load_templates(path: str = TEMPLATES_FILE) -> NotificationTemplates:
+    config = json.loads(json.dumps(DEFAULT_TEMPLATES))
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            custom = json.load(f)
+        for section in ("embeds", "creators"):
+            for name, spec in custom.get(section, {}).items():
+                config[section][name] = {**config[section].get(name, {}), **spec}
+        config["links"].update(custom.get("links", {}))
+        logger.info(f"Шаблоны уведомлений загружены из {path}")
+    except FileNotFoundError:
+        pass
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Ошибка загрузки шаблонов {path}: {e}, используются шаблоны по умолчанию")
+    return NotificationTemplates(config)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+
+    @staticmethod
+    def label_key(labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def format_labels(key: tuple, extra: tuple = ()) -> str:
+        items = key + extra
+        if not items:
+            return ""
+        return "{" + ",".join(f'{name}="{str(value)}"' for name, value in items) + "}"
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = self.label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["counts"][i] += 1
+                break
+        series["sum"] += value
+        series["count"] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self.format_labels(key, (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self.format_labels(key, (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {series['count']}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    def __init__(self, name: str, documentation: str, kind: str, callback):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self) -> list[str]:
+        value = self.callback()
+        if isinstance(value, dict):
+            return [f"{self.name}{self.format_labels(key)} {sample}" for key, sample in value.items()]
+        return [f"{self.name} {value}"]
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        metric.name = self.prefix + metric.name
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.register(Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, buckets))
+
+    def gauge(self, name: str, documentation: str, callback) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, "gauge", callback))
+
+    def counter_callback(self, name: str, documentation: str, callback) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, "counter", callback))
+
+    def render(self) -> str:
+        parts = []
+        for metric in self.metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+        return "".join(parts)
+
+
+@dataclass
+class LiveAnnouncement:
+    username: str
+    stream_id: str
+    started_at: float
+    messages: dict[int, int] = field(default_factory=dict)
+    values: dict = field(default_factory=dict)
+    edited_at: float = 0.0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LiveAnnouncement":
+        return cls(
+            username=data["username"],
+            stream_id=data.get("stream_id") or "",
+            started_at=data.get("started_at") or time.time(),
+            messages={int(channel_id): int(message_id) for channel_id, message_id in data.get("messages", {}).items()},
+            values=data.get("values") or {},
+            edited_at=data.get("edited_at") or 0.0
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "username": self.username,
+            "stream_id": self.stream_id,
+            "started_at": self.started_at,
+            "messages": {str(channel_id): message_id for channel_id, message_id in self.messages.items()},
+            "values": self.values,
+            "edited_at": self.edited_at
+        }
+
+
+class LiveUpdater:
+    def __init__(self, interval: float = LIVE_EDIT_INTERVAL):
+        self.interval = interval
+        self.announcements: dict[str, LiveAnnouncement] = {}
+        self.deferred: dict[str, asyncio.Task] = {}
+
+    def load(self, data: dict):
+        self.announcements = {username: LiveAnnouncement.from_dict(item) for username, item in data.items()}
+
+    def save(self):
+        state_store.put_many({"live_announcements": {username: announcement.to_dict() for username, announcement in self.announcements.items()}})
+
+    def track(self, username: str, result: FanOutResult, values: dict):
+        messages = {target.channel_id: target.message_id for target in result.targets if target.ok and target.message_id}
+        if not messages:
+            return
+        stream = twitch_streams.get(username) or {}
+        self.announcements[username] = LiveAnnouncement(username, stream.get("id") or "", stream.get("started_at") or time.time(), messages, values, time.time())
+        self.save()
+
+    def restarted(self, username: str) -> bool:
+        announcement = self.announcements.get(username)
+        stream_id = (twitch_streams.get(username) or {}).get("id")
+        return bool(announcement and announcement.stream_id and stream_id and stream_id != announcement.stream_id)
+
+    async def refresh(self, username: str):
+        announcement = self.announcements.get(username)
+        if announcement is None or username in self.deferred:
+            return
+        values = twitch_stream_values(username)
+        if values == announcement.values:
+            LIVE_EDITS_TOTAL.inc(outcome="unchanged")
+            return
+        wait = announcement.edited_at + self.interval - time.time()
+        if wait > 0:
+            LIVE_EDITS_TOTAL.inc(outcome="deferred")
+            self.deferred[username] = asyncio.create_task(self.refresh_later(username, wait))
+            return
+        announcement.values = values
+        announcement.edited_at = time.time()
+        await self.apply(announcement, templates.render("twitch", username, **values), "edited")
+        self.save()
+
+    async def refresh_later(self, username: str, delay: float):
+        await asyncio.sleep(delay)
+        self.deferred.pop(username, None)
+        await self.refresh(username)
+
+    async def finish(self, username: str):
+        task = self.deferred.pop(username, None)
+        if task:
+            task.cancel()
+        announcement = self.announcements.pop(username, None)
+        if announcement is None:
+            return
+        values = {key: value for key, value in announcement.values.items() if key not in ("image", "uptime")}
+        values["duration"] = format_duration(time.time() - announcement.started_at)
+        await self.apply(announcement, templates.render("twitch_ended", username, **values), "finalized")
+        self.save()
+
+    async def apply(self, announcement: LiveAnnouncement, embed: disnake.Embed, outcome: str):
+        async def edit(channel_id: int, message_id: int):
+            channel = resolve_channel(channel_id)
+            if channel is None:
+                return
+            try:
+                await dispatcher.edit(channel, message_id, embed=embed)
+                LIVE_EDITS_TOTAL.inc(outcome=outcome)
+            except Exception as e:
+                LIVE_EDITS_TOTAL.inc(outcome="failed")
+                logger.warning("Не удалось обновить анонс %s в канале %s: %s", announcement.username, channel_id, e)
+                if getattr(e, "status", None) == 404:
+                    announcement.messages.pop(channel_id, None)
+
+        await asyncio.gather(*(edit(channel_id, message_id) for channel_id, message_id in list(announcement.messages.items())))
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = WATCHDOG_INTERVAL, threshold: float = WATCHDOG_THRESHOLD, history: int = WATCHDOG_HISTORY):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=history)
+        self.stall_count = 0
+        self.current = None
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.beat = time.monotonic()
+        self.loop_thread_id = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    async def run(self):
+        self.loop_thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+            self.thread.start()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.beat = time.monotonic()
+            self.lag = max(0.0, self.beat - started - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def blocked_for(self) -> float:
+        return max(0.0, time.monotonic() - self.beat - self.interval)
+
+    def watch(self):
+        while not self.stopped.wait(self.interval / 2):
+            blocked = self.blocked_for()
+            if blocked >= self.threshold:
+                if self.current is None:
+                    self.current = {"detected_at": time.time(), "blocked_seconds": blocked, "stack": self.sample_stack()}
+                    self.stalls.append(self.current)
+                    self.stall_count += 1
+                    logger.warning("Цикл событий заблокирован уже %.2f с:\n%s", blocked, self.current["stack"])
+                else:
+                    self.current["blocked_seconds"] = blocked
+            elif self.current is not None:
+                logger.warning("Цикл событий был заблокирован %.2f с", self.current["blocked_seconds"])
+                self.current = None
+
+    def sample_stack(self) -> str:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return ""
+        return "".join(traceback.format_stack(frame, limit=-WATCHDOG_STACK_DEPTH))
+
+    def recent_stalls(self, window: float) -> list[dict]:
+        cutoff = time.time() - window
+        return [dict(stall) for stall in self.stalls if stall["detected_at"] >= cutoff]
+
+    def stop(self):
+        self.stopped.set()
+
+
+def create_state_store(backend: str = STATE_BACKEND) -> StateStore:
+    if backend == "json":
+        return JsonStateStore(STATE_FILE)
+    if backend == "sqlite":
+        return SqliteStateStore(STATE_DB)
+    raise ValueError(f"Неизвестный STATE_BACKEND: {backend}")
+
+
+def create_coordinator(backend: str = COORDINATION_BACKEND, mode: str = COORDINATION_MODE) -> Coordinator:
+    if mode not in ("leader", "partition"):
+        raise ValueError(f"Неизвестный COORDINATION_MODE: {mode}")
+    if backend == "none":
+        return Coordinator(mode=mode)
+    if backend == "sqlite":
+        return SqliteCoordinator(COORDINATION_DB, mode=mode)
+    if backend == "file":
+        return FileCoordinator(COORDINATION_DIR, mode=mode)
+    raise ValueError(f"Неизвестный COORDINATION_BACKEND: {backend}")
+
+
+def http_connector_options() -> dict:
+    return {
+        "limit": HTTP_POOL_LIMIT,
+        "limit_per_host": HTTP_POOL_LIMIT_PER_HOST,
+        "ttl_dns_cache": HTTP_DNS_CACHE_TTL,
+        "keepalive_timeout": HTTP_KEEPALIVE_SECONDS
+    }
+
+
+def http_timeout(total: float = HTTP_TIMEOUT) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(total=total, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(**http_connector_options()),
+        timeout=http_timeout()
+    )
+
+
+def release_pending_preview(message_id: str, form_data: dict, reason: str):
+    logger.info(f"Черновик {message_id} удалён из хранилища ({reason})")
+    preview_store.release(form_data.get("preview_id"))
 
 
 http_session = None
 last_youtube_video_id = None
 last_video_title = None
 last_youtube_video_sent_time = 0
-twitch_stream_live = False
-twitch_stream_check = False
-send_lock = asyncio.Lock()
-temp_storage = {}
+seen_videos = SeenVideoIndex(SEEN_VIDEOS_LIMIT)
+legacy_last_video_ids = {}
+thumbnail_cache = TTLCache(THUMBNAIL_CACHE_SIZE, THUMBNAIL_CACHE_TTL)
+thumbnail_probes = {}
+feed_validators = {}
+delivery_log = deque(maxlen=DELIVERY_LOG_LIMIT)
+twitch_executor = None
+feed_parse_executor = None
+streamlink_session = None
+streamlink_session_lock = threading.Lock()
+twitch_checks_in_flight = {}
+twitch_live_status = {}
+twitch_streams = {}
+poll_activity = {}
+websub_leases = {}
+websub_tasks = set()
+loop_lag_task = None
+coordination_task = None
+webserver_runner = None
+services_started = asyncio.Event()
+discord_connect_started = STARTUP_STARTED
+websub_secret = WEBSUB_SECRET or secrets.token_hex(16)
+send_lock = None
+with startup_step("init state store"):
+    state_store = create_state_store()
+coordinator = create_coordinator()
+dispatcher = DiscordDispatcher()
+preview_store = PreviewStore(TEMP_IMAGE_DIR)
+with startup_step("load templates"):
+    templates = load_templates()
+webhook_channels = load_webhooks() if DELIVERY_BACKEND == "webhook" else {}
+loop_watchdog = LoopWatchdog()
+live_updater = LiveUpdater()
+metrics = MetricsRegistry("discord_bot_")
+RSS_FETCH_SECONDS = metrics.histogram("rss_fetch_seconds", "Time to fetch a YouTube RSS feed")
+FEED_PARSE_SECONDS = metrics.histogram("feed_parse_seconds", "Time to parse a YouTube RSS feed")
+THUMBNAIL_PROBE_SECONDS = metrics.histogram("thumbnail_probe_seconds", "Time to probe an image URL")
+TWITCH_CHECK_SECONDS = metrics.histogram("twitch_check_seconds", "Time to check Twitch liveness for a batch of streamers")
+DISCORD_SEND_SECONDS = metrics.histogram("discord_send_seconds", "Time of a single Discord send call")
+DETECTION_TO_POST_SECONDS = metrics.histogram("detection_to_post_seconds", "Time from detecting an event to posting it", (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300))
+POSTS_TOTAL = metrics.counter("posts_total", "Announcements posted to Discord")
+LIVE_EDITS_TOTAL = metrics.counter("live_edits_total", "Live announcement edits by outcome")
+FANOUT_DELIVERIES_TOTAL = metrics.counter("fanout_deliveries_total", "Per-target announcement deliveries by outcome")
+RSS_NOT_MODIFIED_TOTAL = metrics.counter("rss_not_modified_total", "RSS fetches answered with 304 Not Modified")
+metrics.counter_callback("dispatch_retries_total", "Discord sends retried by the dispatcher", lambda: dispatcher.metrics["retried"])
+metrics.counter_callback("dispatch_failures_total", "Discord sends that failed after retries", lambda: dispatcher.metrics["failed"])
+metrics.counter_callback("cache_hits_total", "Cache hits", lambda: {(("cache", "thumbnail"),): thumbnail_cache.hits, (("cache", "pending_confirm"),): temp_storage.hits})
+metrics.counter_callback("cache_misses_total", "Cache misses", lambda: {(("cache", "thumbnail"),): thumbnail_cache.misses, (("cache", "pending_confirm"),): temp_storage.misses})
+metrics.counter_callback("cache_evictions_total", "Cache entries evicted or expired", lambda: {(("cache", "thumbnail"),): thumbnail_cache.evictions + thumbnail_cache.expiries, (("cache", "pending_confirm"),): temp_storage.evictions + temp_storage.expiries})
+metrics.gauge("dispatch_queue_depth", "Discord sends waiting in the dispatch queue", lambda: dispatcher.depth())
+metrics.gauge("live_announcements", "Live announcements being kept up to date", lambda: len(live_updater.announcements))
+metrics.gauge("temp_storage_size", "Pending Telegram confirmations", lambda: len(temp_storage))
+metrics.gauge("preview_memory_bytes", "Bytes of Telegram previews held in memory", lambda: preview_store.memory_used)
+metrics.gauge("coordination_leader", "1 if this instance holds the poller lease", lambda: int(coordinator.leader))
+metrics.gauge("coordination_members", "Live instances sharing the watched sources", lambda: len(coordinator.members))
+metrics.gauge("event_loop_lag_seconds", "Most recent event loop lag sample", lambda: loop_watchdog.lag)
+metrics.gauge("event_loop_lag_max_seconds", "Largest event loop lag since start", lambda: loop_watchdog.max_lag)
+metrics.counter_callback("event_loop_stalls_total", "Event loop stalls longer than the watchdog threshold", lambda: loop_watchdog.stall_count)
+temp_storage = TTLCache(PENDING_CONFIRM_LIMIT, PENDING_CONFIRM_TTL, on_evict=release_pending_preview)
 
 
 if not os.path.exists(TEMP_IMAGE_DIR):
@@ -99,49 +1810,128 @@ bot = commands.Bot(command_prefix="/", intents=intents, help_command=None)
 def load_state():
     global last_youtube_video_id, last_video_title, last_youtube_video_sent_time
     try:
-        with open(STATE_FILE, "r") as f:
-            state = json.load(f)
-            last_youtube_video_id = state.get("last_video_id")
-            last_video_title = state.get("last_video_title")
-            last_youtube_video_sent_time = state.get("last_sent_time", 0)
-            logger.info(f"Состояние загружено: {last_youtube_video_id}, {last_video_title}")
+        state = state_store.load()
+        last_youtube_video_id = state.get("last_video_id")
+        last_video_title = state.get("last_video_title")
+        last_youtube_video_sent_time = state.get("last_sent_time", 0)
+        seen_videos.load(state.get("seen_videos", {}))
+        feed_validators.update(state.get("feed_validators", {}))
+        poll_activity.update(state.get("poll_activity", {}))
+        legacy_last_video_ids.update(state.get("last_feed_video_ids", {}))
+        live_updater.load(state.get("live_announcements", {}))
+        twitch_live_status.update(dict.fromkeys(live_updater.announcements, True))
+        if last_youtube_video_id and YOUTUBE_FEEDS:
+            legacy_last_video_ids.setdefault(YOUTUBE_FEEDS[0], last_youtube_video_id)
+        logger.info(f"Состояние загружено: {last_youtube_video_id}, {last_video_title}")
     except (FileNotFoundError, json.JSONDecodeError):
         logger.info("Файл состояния не найден или повреждён, состояние сброшено.")
 
 
 def save_state():
-    try:
-        with open(STATE_FILE, "w") as f:
-            json.dump({
-                "last_video_id": last_youtube_video_id,
-                "last_video_title": last_video_title,
-                "last_sent_time": last_youtube_video_sent_time
-            }, f)
-        logger.info(f"Состояние сохранено: {last_youtube_video_id}, {last_video_title}")
-    except Exception as e:
-        logger.error(f"Ошибка сохранения состояния: {e}")
+    state_store.put_many({
+        "last_video_id": last_youtube_video_id,
+        "last_video_title": last_video_title,
+        "last_sent_time": last_youtube_video_sent_time,
+        "seen_videos": seen_videos.to_dict(),
+        "feed_validators": {url: dict(validators) for url, validators in feed_validators.items()}
+    })
 
 
 async def is_image_available(url: str) -> bool:
+    with THUMBNAIL_PROBE_SECONDS.time():
+        return await probe_image(url)
+
+
+async def probe_image(url: str) -> bool:
     try:
-        async with http_session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
-            return resp.status == 200
+        timeout = http_timeout(THUMBNAIL_PROBE_TIMEOUT)
+        async with http_session.head(url, timeout=timeout, allow_redirects=True) as resp:
+            if resp.status not in (403, 405, 501):
+                return resp.status == 200
+        async with http_session.get(url, headers={"Range": "bytes=0-0"}, timeout=timeout) as resp:
+            return resp.status in (200, 206)
     except Exception as e:
         logger.error(f"[Ошибка изображения] {e}")
         return False
 
 
-async def fetch_youtube_rss():
+async def probe_youtube_thumbnail(video_id: str) -> str | None:
+    thumbnail = None
+    for quality in ("maxresdefault", "hqdefault"):
+        thumbnail_url = YOUTUBE_THUMBNAIL_URL.format(video_id=video_id, quality=quality)
+        if await is_image_available(thumbnail_url):
+            thumbnail = thumbnail_url
+            break
+    thumbnail_cache.set(video_id, thumbnail, None if thumbnail else THUMBNAIL_NEGATIVE_TTL)
+    return thumbnail
+
+
+async def resolve_youtube_thumbnail(video_id: str) -> str | None:
+    thumbnail = thumbnail_cache.get(video_id)
+    if thumbnail is not TTLCache.MISSING:
+        return thumbnail
+    probe = thumbnail_probes.get(video_id)
+    if probe is None:
+        probe = asyncio.ensure_future(probe_youtube_thumbnail(video_id))
+        thumbnail_probes[video_id] = probe
+        probe.add_done_callback(lambda _: thumbnail_probes.pop(video_id, None))
+    return await asyncio.shield(probe)
+
+
+FEED_NOT_MODIFIED = object()
+FEED_REJECTED = object()
+
+
+async def fetch_youtube_rss(url: str = YOUTUBE_CHANNEL_RSS):
+    headers = {"User-Agent": "Mozilla/5.0"}
+    validators = feed_validators.get(url, {})
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    started = time.perf_counter()
     try:
-        async with http_session.get(YOUTUBE_CHANNEL_RSS, headers={"User-Agent": "Mozilla/5.0"}, timeout=10) as response:
+        async with http_session.get(url, headers=headers, timeout=http_timeout(RSS_FETCH_TIMEOUT)) as response:
+            if response.status == 304:
+                RSS_FETCH_SECONDS.observe(time.perf_counter() - started)
+                RSS_NOT_MODIFIED_TOTAL.inc()
+                return FEED_NOT_MODIFIED
             if response.status == 200:
-                return feedparser.parse(await response.text())
-            logger.warning(f"Ошибка при получении RSS, статус: {response.status}")
+                body = await response.read()
+                RSS_FETCH_SECONDS.observe(time.perf_counter() - started)
+                feed = await parse_feed(url, body)
+                feed_validators[url] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified")
+                }
+                return feed
+            logger.warning("Ошибка при получении RSS %s, статус: %s", url, response.status)
+            if 400 <= response.status < 500 and response.status not in (408, 429):
+                return FEED_REJECTED
     except Exception as e:
-        logger.error(f"Ошибка при загрузке RSS: {e}")
+        logger.error(f"Ошибка при загрузке RSS {url}: {e}")
     return None
 
 
+async def parse_feed(url: str, body: bytes) -> YouTubeFeed:
+    is_known = (lambda video_id: seen_videos.is_seen(url, video_id)) if seen_videos.has_source(url) else None
+    with FEED_PARSE_SECONDS.time():
+        if len(body) < RSS_PARSE_OFFLOAD_BYTES:
+            return parse_feed_body(body, is_known)
+        return await asyncio.get_running_loop().run_in_executor(feed_parse_executor, parse_feed_body, body, is_known)
+
+
+async def fetch_youtube_feeds(urls: list[str]) -> dict:
+    semaphore = asyncio.Semaphore(RSS_FETCH_CONCURRENCY)
+
+    async def fetch(url):
+        async with semaphore:
+            return await fetch_youtube_rss(url)
+
+    results = await asyncio.gather(*(fetch(url) for url in urls))
+    return dict(zip(urls, results))
+
+
 def extract_video_id(link: str) -> str | None:
     try:
         parsed = urlparse(link)
@@ -170,120 +1960,457 @@ async def get_video_preview_url(video_url: str) -> str | None:
     if parsed.hostname in ("www.youtube.com", "youtube.com", "youtu.be"):
         video_id = extract_video_id(video_url)
         if video_id:
-            thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-            if await is_image_available(thumbnail_url):
-                return thumbnail_url
-            thumbnail_url = f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-            if await is_image_available(thumbnail_url):
+            thumbnail_url = await resolve_youtube_thumbnail(video_id)
+            if thumbnail_url:
                 return thumbnail_url
     logger.warning(f"Не удалось получить превью для URL: {video_url}")
     return None
 
 
-async def get_latest_youtube_video(retry=3):
-    global last_youtube_video_id, last_video_title, last_youtube_video_sent_time
-    for attempt in range(retry):
-        feed = await fetch_youtube_rss()
-        if not feed or not feed.entries:
-            logger.warning(f"❌ Нет записей в YouTube RSS (попытка {attempt+1}/{retry})")
-            await asyncio.sleep(10)
-            continue
-        invalid_urls = []
-        for entry in feed.entries:
-            video_url = entry.link.lower()
-            if "shorts" in video_url or "/shorts/" in video_url:
-                continue
-            video_id = extract_video_id(entry.link)
-            if not video_id:
-                invalid_urls.append(entry.link)
-                continue
-            if video_id != last_youtube_video_id:
-                last_youtube_video_id = video_id
-                last_video_title = entry.title
-                last_youtube_video_sent_time = asyncio.get_event_loop().time()
-                save_state()
-                logger.info(f"Найдено новое полное видео: {entry.title} ({video_id})")
-                return {"title": entry.title, "link": entry.link}
-            elif asyncio.get_event_loop().time() - last_youtube_video_sent_time > 300:
-                logger.info("Новое полное видео не найдено, последнее видео уже отправлено.")
-                return None
-        if invalid_urls:
-            logger.warning(f"Пропущены невалидные URL ({len(invalid_urls)}): {', '.join(invalid_urls[:3])}{'...' if len(invalid_urls) > 3 else ''}")
-        logger.info("Все видео в RSS являются Shorts или уже отправлены.")
+def published_at(entry) -> float | None:
+    published = entry.get("published_parsed")
+    if not published:
         return None
-    return None
+    return dt.datetime(*published[:6], tzinfo=dt.timezone.utc).timestamp()
 
 
-async def is_twitch_stream_live() -> bool:
-    try:
-        loop = asyncio.get_running_loop()
-        with ThreadPoolExecutor() as pool:
-            streams = await loop.run_in_executor(pool, streamlink.streams, f"https://twitch.tv/{TWITCH_USERNAME}")
-        return bool(streams)
-    except Exception as e:
-        logger.warning(f"[Ошибка проверки Twitch] {e}")
-        return False
+def published_age(entry) -> float | None:
+    published = published_at(entry)
+    return None if published is None else time.time() - published
 
 
-def create_social_buttons(video_url="") -> View:
-    view = View()
-    dynamic_label = "🔗 Ссылка" if video_url else "🔗 Нет ссылки"
-    view.add_item(Button(label=dynamic_label, url=video_url or "https://t.me/kamyshovnik", style=disnake.ButtonStyle.link))
-    links = {
-        "💬 Telegram": "https://t.me/kamyshovnik",
-        "📘 VK": "https://vk.com/kamyshovnik",
-        "🎵 TikTok": "https://www.tiktok.com/@xkamysh",
-        "💖 Boosty": "https://boosty.to/xkamysh",
+def find_new_feed_videos(url: str, feed, max_age: float | None = None, since: float | None = None) -> list[dict]:
+    global last_video_title
+    invalid_urls = []
+    candidates = []
+    for entry in feed.entries:
+        video_url = entry.link.lower()
+        if "shorts" in video_url or "/shorts/" in video_url:
+            continue
+        video_id = extract_video_id(entry.link)
+        if not video_id:
+            invalid_urls.append(entry.link)
+            continue
+        candidates.append((video_id, entry))
+    if invalid_urls:
+        logger.warning(f"Пропущены невалидные URL ({len(invalid_urls)}): {', '.join(invalid_urls[:3])}{'...' if len(invalid_urls) > 3 else ''}")
+    if not seen_videos.has_source(url):
+        legacy_id = legacy_last_video_ids.pop(url, None)
+        known_ids = [video_id for video_id, _ in candidates]
+        if legacy_id in known_ids:
+            unseen = candidates[:known_ids.index(legacy_id)]
+        elif since is not None:
+            unseen = [(video_id, entry) for video_id, entry in candidates if (published_at(entry) or 0) >= since]
+        else:
+            unseen = []
+        for video_id, _ in reversed(candidates):
+            seen_videos.add(url, video_id)
+    else:
+        unseen = [(video_id, entry) for video_id, entry in candidates if not seen_videos.is_seen(url, video_id)]
+    if max_age is not None:
+        stale = [(video_id, entry) for video_id, entry in unseen if (published_age(entry) or 0) > max_age]
+        for video_id, entry in stale:
+            seen_videos.add(url, video_id)
+            logger.info("Пропущено обновление старого видео: %s (%s, опубликовано %s)", entry.title, video_id, entry.get("published", ""))
+        unseen = [item for item in unseen if item not in stale]
+    new_videos = []
+    for video_id, entry in sorted(reversed(unseen), key=lambda item: item[1].get("published_parsed") or ()):
+        seen_videos.add(url, video_id)
+        last_video_title = entry.title
+        logger.info("Найдено новое полное видео: %s (%s)", entry.title, video_id)
+        new_videos.append({"title": entry.title, "link": entry.link, "published": entry.get("published", ""), "source": url, "detected_at": time.monotonic()})
+    return new_videos
+
+
+async def get_latest_youtube_video(feeds: list[str] | None = None, since: float | None = None) -> tuple[list[dict], list[str]]:
+    new_videos = []
+    failed = []
+    not_modified = 0
+    changed = False
+    takeover = coordinator.takeover_since()
+    if takeover is not None:
+        since = takeover if since is None else min(since, takeover)
+    feeds = await fetch_youtube_feeds(list(YOUTUBE_FEEDS if feeds is None else feeds))
+    for url, feed in feeds.items():
+        if feed is FEED_NOT_MODIFIED:
+            not_modified += 1
+            continue
+        if feed is FEED_REJECTED:
+            continue
+        if not feed or (not feed.entries and feed.complete):
+            failed.append(url)
+            continue
+        changed = True
+        new_videos.extend(find_new_feed_videos(url, feed, since=since))
+    if failed:
+        logger.warning(f"❌ Нет записей в YouTube RSS для {len(failed)} лент")
+    if changed:
+        save_state()
+    new_videos.sort(key=lambda video: video["published"])
+    logger.info("RSS проверено: %d лент, без изменений (304): %d, новых видео: %d", len(feeds), not_modified, len(new_videos))
+    return new_videos, failed
+
+
+def streamlink_streams(url: str) -> dict:
+    global streamlink_session
+    if streamlink_session is None:
+        with streamlink_session_lock:
+            if streamlink_session is None:
+                streamlink_session = streamlink.Streamlink()
+    return streamlink_session.streams(url)
+
+
+async def check_twitch_streams(usernames: list[str], timeout: float = TWITCH_CHECK_TIMEOUT) -> dict[str, bool | None]:
+    loop = asyncio.get_running_loop()
+    checks = {}
+    for username in usernames:
+        future = twitch_checks_in_flight.get(username)
+        if future is None or future.done():
+            future = twitch_executor.submit(streamlink_streams, f"https://twitch.tv/{username}")
+            twitch_checks_in_flight[username] = future
+        checks[username] = asyncio.wrap_future(future, loop=loop)
+    if not checks:
+        return {}
+    _, pending = await asyncio.wait(checks.values(), timeout=timeout)
+    results = {}
+    for username, check in checks.items():
+        if check in pending:
+            check.cancel()
+            logger.warning("[Ошибка проверки Twitch] %s: превышено время ожидания (%s с)", username, timeout)
+            results[username] = None
+            continue
+        twitch_checks_in_flight.pop(username, None)
+        if check.cancelled():
+            results[username] = None
+        elif check.exception():
+            logger.warning("[Ошибка проверки Twitch] %s: %s", username, check.exception())
+            results[username] = None
+        else:
+            results[username] = bool(check.result())
+    return results
+
+
+class LivenessProvider:
+    name = "base"
+
+    async def check(self, usernames: list[str]) -> dict[str, bool | None]:
+        raise NotImplementedError
+
+
+class StreamlinkLivenessProvider(LivenessProvider):
+    name = "streamlink"
+
+    async def check(self, usernames: list[str]) -> dict[str, bool | None]:
+        with TWITCH_CHECK_SECONDS.time(backend=self.name):
+            return await check_twitch_streams(usernames)
+
+
+class TwitchHelixLivenessProvider(LivenessProvider):
+    name = "helix"
+
+    def __init__(self, url: str = TWITCH_HELIX_URL, token_url: str = TWITCH_TOKEN_URL, client_id: str = TWITCH_CLIENT_ID, client_secret: str = TWITCH_CLIENT_SECRET, batch_size: int = TWITCH_HELIX_BATCH_SIZE):
+        self.url = url
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.batch_size = min(batch_size, 100)
+        self.token = None
+        self.token_expires_at = 0.0
+        self.token_lock = asyncio.Lock()
+
+    async def check(self, usernames: list[str]) -> dict[str, bool | None]:
+        batches = [usernames[i:i + self.batch_size] for i in range(0, len(usernames), self.batch_size)]
+        results = {}
+        with TWITCH_CHECK_SECONDS.time(backend=self.name):
+            for batch_results in await asyncio.gather(*(self.check_batch(batch) for batch in batches)):
+                results.update(batch_results)
+        return results
+
+    async def access_token(self, expired: str | None = None) -> str:
+        async with self.token_lock:
+            if self.token and self.token != expired and time.time() < self.token_expires_at:
+                return self.token
+            async with http_session.post(
+                self.token_url,
+                data={"client_id": self.client_id, "client_secret": self.client_secret, "grant_type": "client_credentials"},
+                timeout=http_timeout(TWITCH_CHECK_TIMEOUT)
+            ) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"токен приложения не получен, статус {resp.status}")
+                data = await resp.json()
+            self.token = data["access_token"]
+            self.token_expires_at = time.time() + max(int(data.get("expires_in", 3600)) - 60, 0)
+            return self.token
+
+    async def check_batch(self, usernames: list[str]) -> dict[str, bool | None]:
+        params = [("first", "100")] + [("user_login", name.lower()) for name in usernames]
+        try:
+            token = await self.access_token()
+            for attempt in range(2):
+                async with http_session.get(
+                    f"{self.url}/streams",
+                    params=params,
+                    headers={"Client-ID": self.client_id, "Authorization": f"Bearer {token}"},
+                    timeout=http_timeout(TWITCH_CHECK_TIMEOUT)
+                ) as resp:
+                    if resp.status == 401 and not attempt:
+                        token = await self.access_token(expired=token)
+                        continue
+                    if resp.status != 200:
+                        logger.warning(f"[Ошибка проверки Twitch] Helix статус: {resp.status}")
+                        return dict.fromkeys(usernames)
+                    data = (await resp.json()).get("data") or []
+                    break
+        except Exception as e:
+            logger.warning(f"[Ошибка проверки Twitch] Helix: {e}")
+            return dict.fromkeys(usernames)
+        live = {stream.get("user_login", "").lower(): stream for stream in data if stream.get("type") == "live"}
+        results = {}
+        for name in usernames:
+            stream = live.get(name.lower())
+            results[name] = bool(stream)
+            if stream:
+                twitch_streams[name] = parse_helix_stream(stream)
+        return results
+
+
+class TwitchGQLLivenessProvider(LivenessProvider):
+    name = "gql"
+
+    def __init__(self, url: str = TWITCH_GQL_URL, client_id: str = TWITCH_GQL_CLIENT_ID, batch_size: int = TWITCH_GQL_BATCH_SIZE):
+        self.url = url
+        self.client_id = client_id
+        self.batch_size = batch_size
+
+    async def check(self, usernames: list[str]) -> dict[str, bool | None]:
+        batches = [usernames[i:i + self.batch_size] for i in range(0, len(usernames), self.batch_size)]
+        results = {}
+        with TWITCH_CHECK_SECONDS.time(backend=self.name):
+            for batch_results in await asyncio.gather(*(self.check_batch(batch) for batch in batches)):
+                results.update(batch_results)
+        return results
+
+    async def check_batch(self, usernames: list[str]) -> dict[str, bool | None]:
+        fields = " ".join(f"u{i}: user(login: {json.dumps(name.lower())}) {{ stream {{ {TWITCH_GQL_STREAM_FIELDS} }} }}" for i, name in enumerate(usernames))
+        try:
+            async with http_session.post(
+                self.url,
+                json={"query": f"query {{ {fields} }}"},
+                headers={"Client-ID": self.client_id},
+                timeout=http_timeout(TWITCH_CHECK_TIMEOUT)
+            ) as resp:
+                if resp.status != 200:
+                    logger.warning(f"[Ошибка проверки Twitch] GQL статус: {resp.status}")
+                    return dict.fromkeys(usernames)
+                data = (await resp.json()).get("data") or {}
+        except Exception as e:
+            logger.warning(f"[Ошибка проверки Twitch] GQL: {e}")
+            return dict.fromkeys(usernames)
+        results = {}
+        for i, name in enumerate(usernames):
+            alias = f"u{i}"
+            if alias not in data:
+                results[name] = None
+            else:
+                stream = (data[alias] or {}).get("stream")
+                results[name] = bool(stream)
+                if stream:
+                    twitch_streams[name] = parse_twitch_stream(stream)
+        return results
+
+
+def parse_twitch_stream(stream: dict) -> dict:
+    created_at = stream.get("createdAt")
+    return {
+        "id": stream.get("id"),
+        "title": stream.get("title"),
+        "game": (stream.get("game") or {}).get("displayName"),
+        "started_at": dt.datetime.fromisoformat(created_at).timestamp() if created_at else None,
+        "thumbnail": stream.get("previewImageURL"),
+        "viewers": stream.get("viewersCount")
+    }
+
+
+def parse_helix_stream(stream: dict) -> dict:
+    started_at = stream.get("started_at")
+    thumbnail = stream.get("thumbnail_url")
+    return {
+        "id": stream.get("id"),
+        "title": stream.get("title"),
+        "game": stream.get("game_name") or None,
+        "started_at": dt.datetime.fromisoformat(started_at).timestamp() if started_at else None,
+        "thumbnail": thumbnail.replace("{width}", "1280").replace("{height}", "720") if thumbnail else None,
+        "viewers": stream.get("viewer_count")
     }
-    for label, url in links.items():
-        view.add_item(Button(label=label, url=url, style=disnake.ButtonStyle.link))
-    return view
 
 
-async def send_youtube_notification(channel, video):
-    global last_youtube_video_sent_time
+def twitch_stream_values(username: str) -> dict:
+    stream = twitch_streams.get(username) or {}
+    values = {"username": username, "stream_title": stream.get("title"), "game": stream.get("game")}
+    if stream.get("started_at"):
+        values["uptime"] = f"<t:{int(stream['started_at'])}:R>"
+    if stream.get("thumbnail"):
+        values["image"] = f"{stream['thumbnail']}?t={int(time.time() // LIVE_THUMBNAIL_REFRESH)}"
+    return values
+
+
+def format_duration(seconds: float) -> str:
+    hours, minutes = divmod(int(max(0.0, seconds) // 60), 60)
+    return f"{hours} ч {minutes:02d} мин" if hours else f"{minutes} мин"
+
+
+class FallbackLivenessProvider(LivenessProvider):
+    def __init__(self, primary: LivenessProvider, fallback: LivenessProvider):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+
+    async def check(self, usernames: list[str]) -> dict[str, bool | None]:
+        results = await self.primary.check(usernames)
+        unknown = [name for name in usernames if results.get(name) is None]
+        if unknown:
+            logger.info("Проверка Twitch через %s для %d каналов", self.fallback.name, len(unknown))
+            results.update(await self.fallback.check(unknown))
+        return results
+
+
+def create_liveness_provider(backend: str = TWITCH_LIVENESS_BACKEND) -> LivenessProvider:
+    if backend == "streamlink":
+        return StreamlinkLivenessProvider()
+    if backend == "helix":
+        if not (TWITCH_CLIENT_ID and TWITCH_CLIENT_SECRET):
+            if ENABLE_TWITCH:
+                logger.warning("TWITCH_CLIENT_ID/TWITCH_CLIENT_SECRET не заданы, проверка Twitch только через streamlink")
+            return StreamlinkLivenessProvider()
+        return FallbackLivenessProvider(TwitchHelixLivenessProvider(), StreamlinkLivenessProvider())
+    if backend == "gql":
+        if not TWITCH_GQL_CLIENT_ID:
+            raise ValueError("TWITCH_LIVENESS_BACKEND=gql требует TWITCH_GQL_CLIENT_ID")
+        return FallbackLivenessProvider(TwitchGQLLivenessProvider(), StreamlinkLivenessProvider())
+    raise ValueError(f"Неизвестный TWITCH_LIVENESS_BACKEND: {backend}")
+
+
+liveness_provider = create_liveness_provider()
+
+
+def create_social_buttons(video_url="", channel=None) -> list[Button]:
+    guild = getattr(channel, "guild", None)
+    return templates.components(video_url, guild.id if guild else None)
+
+
+def resolve_channel(channel_id: int):
+    if DELIVERY_BACKEND == "webhook":
+        return webhook_channels.get(channel_id)
+    return bot.get_channel(channel_id)
+
+
+def has_target_channel(channel_ids: list[int]) -> bool:
+    return any(resolve_channel(channel_id) is not None for channel_id in channel_ids)
+
+
+async def fan_out(event: str, platform: str, channel_ids: list[int], priority: int, build_message, detected_at: float | None = None, idempotency_key: str | None = None) -> FanOutResult:
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+    channel_ids = list(dict.fromkeys(channel_ids))
+    keys = {channel_id: f"{idempotency_key}:{channel_id}" for channel_id in channel_ids} if idempotency_key else {}
+    claimed = await coordinator.claim_events(list(keys.values())) if keys else set()
+
+    async def deliver(channel_id: int) -> TargetDelivery:
+        target = TargetDelivery(channel_id)
+        channel = resolve_channel(channel_id)
+        if keys and keys[channel_id] not in claimed:
+            target.duplicate = True
+            logger.debug("%s в канал %s уже отправлено другим экземпляром", event, channel_id)
+            FANOUT_DELIVERIES_TOTAL.inc(platform=platform, outcome="duplicate")
+            return target
+        if channel is None:
+            target.error = DISCORD_CHANNEL_ERROR
+        else:
+            started = time.monotonic()
+            async with semaphore:
+                try:
+                    message = await dispatcher.send(channel, priority, **build_message(channel))
+                    target.ok = True
+                    target.message_id = getattr(message, "id", None)
+                except Exception as e:
+                    target.error = str(e) or e.__class__.__name__
+            target.seconds = time.monotonic() - started
+        if target.ok:
+            POSTS_TOTAL.inc(platform=platform)
+            if detected_at is not None:
+                DETECTION_TO_POST_SECONDS.observe(time.monotonic() - detected_at, platform=platform)
+        else:
+            logger.warning("Не удалось доставить %s в канал %s: %s", event, channel_id, target.error)
+        FANOUT_DELIVERIES_TOTAL.inc(platform=platform, outcome="ok" if target.ok else "failed")
+        return target
+
+    result = FanOutResult(event, platform, time.time(), list(await asyncio.gather(*(deliver(channel_id) for channel_id in channel_ids))))
+    if keys:
+        await coordinator.settle_events(
+            [keys[target.channel_id] for target in result.targets if target.ok],
+            [keys[target.channel_id] for target in result.targets if not target.ok and not target.duplicate]
+        )
+    delivery_log.append(result)
+    if len(result.targets) > 1:
+        logger.info("Рассылка %s: доставлено %d/%d", event, result.delivered, len(result.targets))
+    return result
+
+
+async def send_youtube_notification(video, channel_ids: list[int] | None = None, dedupe: bool = True) -> FanOutResult | None:
+    global last_youtube_video_id, last_youtube_video_sent_time
     async with send_lock:
         now = asyncio.get_event_loop().time()
         video_id = extract_video_id(video["link"])
         if video_id == last_youtube_video_id and (now - last_youtube_video_sent_time < 300):
             logger.info("Повторное видео не отправляется из-за ограничения по времени.")
             return
+        last_youtube_video_id = video_id
         last_youtube_video_sent_time = now
         save_state()
-        thumbnail = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-        if not await is_image_available(thumbnail):
-            thumbnail = f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-            if not await is_image_available(thumbnail):
-                logger.warning(f"Не удалось загрузить превью для видео {video_id}. Используется embed без изображения.")
-                thumbnail = None
-        embed = disnake.Embed(
-            title=f"✨ Новое видео: {video['title']}",
-            url=video["link"],
-            color=disnake.Color.from_rgb(229, 57, 53),
-            timestamp=dt.datetime.now(dt.UTC)
-        )
-        if thumbnail:
-            embed.set_image(url=thumbnail)
-        await channel.send(content="@everyone", embed=embed, view=create_social_buttons(video["link"]))
-        logger.info(f"📢 Отправлено новое видео: {video['title']}")
-
-
-async def send_twitch_notification(channel):
-    global twitch_stream_live
-    embed = disnake.Embed(
-        title=f"🔴 {TWITCH_USERNAME} сейчас стримит!",
-        url=f"https://twitch.tv/{TWITCH_USERNAME}",
-        description="🎉 Заходи на эфир! Общение, атмосфера и веселье ждут тебя!",
-        color=disnake.Color.from_rgb(138, 43, 226),
-        timestamp=dt.datetime.now(dt.UTC)
-    ).set_image(url="https://media.discordapp.net/attachments/722745907279298590/1378720172734545970/134799723_thumbnail.webp?ex=683e4978&is=683cf7f8&hm=199afc43df2a8def8a11ce6bbbe3d7fe79cf3351fa916f1f930428d90a2ca6e2&=&format=webp&width=1522&height=856")
-    embed.set_footer(text=f"Twitch • {TWITCH_USERNAME}", icon_url="https://static.twitchcdn.net/assets/favicon-32-e29e246c157142c94346.png")
-    await channel.send(content="@everyone", embed=embed, view=create_social_buttons(f"https://twitch.tv/{TWITCH_USERNAME}"))
-    logger.info(f"📢 Стрим в эфире: {TWITCH_USERNAME}")
-    twitch_stream_live = True
-
-
-def start_telegram_bot():
+    thumbnail = await resolve_youtube_thumbnail(video_id)
+    if not thumbnail:
+        logger.warning("Не удалось загрузить превью для видео %s. Используется embed без изображения.", video_id)
+    embed = templates.render("youtube", video.get("source"), title=video["title"], link=video["link"], thumbnail=thumbnail)
+    content = templates.content("youtube")
+    result = await fan_out(
+        f"youtube:{video_id}", "youtube", YOUTUBE_TARGET_CHANNEL_IDS if channel_ids is None else channel_ids, PRIORITY_VIDEO,
+        lambda channel: {"content": content, "embed": embed, "components": create_social_buttons(video["link"], channel)},
+        video.get("detected_at"), f"youtube:{video_id}" if dedupe else None
+    )
+    if result.delivered:
+        logger.info("📢 Отправлено новое видео: %s", video["title"])
+    return result
+
+
+async def send_twitch_notification(username: str = TWITCH_USERNAME, detected_at: float | None = None, channel_ids: list[int] | None = None, dedupe: bool = True) -> FanOutResult:
+    stream_id = (twitch_streams.get(username) or {}).get("id")
+    values = twitch_stream_values(username)
+    embed = templates.render("twitch", username, **values)
+    content = templates.content("twitch")
+    url = f"https://twitch.tv/{username}"
+    result = await fan_out(
+        f"twitch:{username}", "twitch", TWITCH_TARGET_CHANNEL_IDS if channel_ids is None else channel_ids, PRIORITY_LIVE,
+        lambda channel: {"content": content, "embed": embed, "components": create_social_buttons(url, channel)},
+        detected_at, f"twitch:{username.lower()}:{stream_id}" if dedupe and stream_id else None
+    )
+    if result.delivered:
+        logger.info("📢 Стрим в эфире: %s", username)
+    if result.delivered or result.duplicates:
+        twitch_live_status[username] = True
+    if result.delivered and dedupe:
+        live_updater.track(username, result, values)
+    return result
+
+
+async def run_telegram_bot():
+    with startup_step("import aiogram"):
+        await asyncio.to_thread(importlib.import_module, "aiogram.fsm.storage.memory")
+        from aiogram import Bot, Dispatcher, F
+        from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+        from aiogram.fsm.context import FSMContext
+        from aiogram.fsm.state import StatesGroup, State
+        from aiogram.fsm.storage.memory import MemoryStorage
+        from aiogram.client.session.aiohttp import AiohttpSession
+
     class Form(StatesGroup):
         waiting_for_title = State()
         waiting_for_preview = State()
@@ -291,285 +2418,469 @@ def start_telegram_bot():
         confirming = State()
 
 
-    async def telegram_main():
-        telegram_bot = Bot(token=TELEGRAM_TOKEN)
-        dp = Dispatcher(storage=MemoryStorage())
+    telegram_session = AiohttpSession(limit=HTTP_POOL_LIMIT)
+    telegram_bot = Bot(token=TELEGRAM_TOKEN, session=telegram_session)
+    dp = Dispatcher(storage=MemoryStorage())
 
-        @dp.errors()
-        async def on_error(update, error):
-            logger.error(f"Error processing update {update.update_id if update else 'N/A'}: {error}", exc_info=True)
-            return True
+    @dp.errors()
+    async def on_error(update, error):
+        logger.error(f"Error processing update {update.update_id if update else 'N/A'}: {error}", exc_info=True)
+        return True
 
-        start_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📝 Создать сообщение", callback_data="create_message")],
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-        ])
+    start_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📝 Создать сообщение", callback_data="create_message")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+    ])
 
-        cancel_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="⏩ Пропустить", callback_data="skip")],
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-        ])
+    cancel_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⏩ Пропустить", callback_data="skip")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+    ])
 
 
-        async def send_preview(message: Message, form_data: dict, confirm_keyboard: InlineKeyboardMarkup):
-            preview_text = (
-                f"<b>Предпросмотр сообщения</b>\n\n"
-                f"<b>Заголовок:</b> {form_data['title'] or 'Не указано'}\n"
-                f"<b>Превью:</b> {'Изображение загружено' if form_data.get('preview_path') else form_data.get('preview_url', 'Не указано')}\n"
-                f"<b>Ссылка:</b> {form_data['video_url'] or 'Не указано'}"
+    async def send_preview(message: Message, form_data: dict, confirm_keyboard: InlineKeyboardMarkup):
+        preview_text = (
+            f"<b>Предпросмотр сообщения</b>\n\n"
+            f"<b>Заголовок:</b> {form_data['title'] or 'Не указано'}\n"
+            f"<b>Превью:</b> {'Изображение загружено' if form_data.get('preview_id') else form_data.get('preview_url', 'Не указано')}\n"
+            f"<b>Ссылка:</b> {form_data['video_url'] or 'Не указано'}"
+        )
+        preview = preview_store.get(form_data.get("preview_id"))
+        if preview:
+            await message.answer_photo(
+                photo=preview.telegram_file(),
+                caption=preview_text,
+                parse_mode="HTML",
+                reply_markup=confirm_keyboard
+            )
+        elif form_data.get("preview_url"):
+            await message.answer_photo(
+                photo=form_data["preview_url"],
+                caption=preview_text,
+                parse_mode="HTML",
+                reply_markup=confirm_keyboard
+            )
+        else:
+            await message.answer(
+                text=preview_text,
+                parse_mode="HTML",
+                reply_markup=confirm_keyboard
             )
-            if form_data.get("preview_path"):
-                await message.answer_photo(
-                    photo=FSInputFile(form_data["preview_path"]),
-                    caption=preview_text,
-                    parse_mode="HTML",
-                    reply_markup=confirm_keyboard
-                )
-            elif form_data.get("preview_url"):
-                await message.answer_photo(
-                    photo=form_data["preview_url"],
-                    caption=preview_text,
-                    parse_mode="HTML",
-                    reply_markup=confirm_keyboard
-                )
-            else:
-                await message.answer(
-                    text=preview_text,
-                    parse_mode="HTML",
-                    reply_markup=confirm_keyboard
-                )
-
-
-        @dp.message(F.text == "/start")
-        async def start_command(message: Message):
-            if message.from_user.id != TELEGRAM_ADMIN_ID:
-                await message.answer(NO_PERMS_MESSAGE)
-                return
-            await message.answer(START_MESSAGE, reply_markup=start_keyboard)
 
 
-        @dp.message(F.text == "/cancel")
-        async def cancel_command(message: Message, state: FSMContext):
-            await state.clear()
-            await message.answer(CANCEL_MESSAGE, reply_markup=start_keyboard)
+    @dp.message(F.text == "/start")
+    async def start_command(message: Message):
+        if message.from_user.id != TELEGRAM_ADMIN_ID:
+            await message.answer(NO_PERMS_MESSAGE)
+            return
+        await message.answer(START_MESSAGE, reply_markup=start_keyboard)
 
 
-        @dp.callback_query(F.data == "create_message")
-        async def forward_to_discord(callback: CallbackQuery, state: FSMContext):
-            if callback.from_user.id != TELEGRAM_ADMIN_ID:
-                await callback.answer(NO_PERMS_MESSAGE)
-                logger.info(f"User {callback.from_user.id} does not have permission (Admin ID: {TELEGRAM_ADMIN_ID})")
-                return
-            current_state = await state.get_state()
-            logger.info(f"Current state before transition: {current_state}")
-            await state.clear()
-            try:
-                if callback.message.text:
-                    await callback.message.edit_text(TITLE_PROMPT, reply_markup=cancel_keyboard)
-                else:
-                    await callback.message.answer(TITLE_PROMPT, reply_markup=cancel_keyboard)
-            except Exception as e:
-                logger.error(f"Error editing message in forward_to_discord: {e}")
-                await callback.message.answer(TITLE_PROMPT, reply_markup=cancel_keyboard)
-            await state.set_state(Form.waiting_for_title)
-            new_state = await state.get_state()
-            logger.info(f"State after transition: {new_state}")
-            await callback.answer()
+    async def clear_form(state: FSMContext):
+        form_data = await state.get_data()
+        await asyncio.to_thread(preview_store.release, form_data.get("preview_id"))
+        await state.clear()
 
 
-        @dp.message(Form.waiting_for_title)
-        async def process_title(message: Message, state: FSMContext):
-            logger.info(f"Received message in waiting_for_title state: {message.text} from user {message.from_user.id}")
-            if message.from_user.id != TELEGRAM_ADMIN_ID:
-                logger.info(f"User {message.from_user.id} does not have permission (Admin ID: {TELEGRAM_ADMIN_ID})")
-                return
-            await state.update_data(title=message.text[:256] if message.text else "")
-            await message.answer(PREVIEW_PROMPT, reply_markup=cancel_keyboard)
-            await state.set_state(Form.waiting_for_preview)
+    @dp.message(F.text == "/cancel")
+    async def cancel_command(message: Message, state: FSMContext):
+        await clear_form(state)
+        await message.answer(CANCEL_MESSAGE, reply_markup=start_keyboard)
 
 
-        @dp.callback_query(F.data == "skip")
-        async def skip_step(callback: CallbackQuery, state: FSMContext):
-            if callback.from_user.id != TELEGRAM_ADMIN_ID:
-                await callback.answer(NO_PERMS_MESSAGE)
-                return
-            current_state = await state.get_state()
-            if current_state == Form.waiting_for_title.state:
-                await state.update_data(title="")
-                await callback.message.edit_text(PREVIEW_PROMPT, reply_markup=cancel_keyboard)
-                await state.set_state(Form.waiting_for_preview)
-            elif current_state == Form.waiting_for_preview.state:
-                await state.update_data(preview_url="", preview_path="")
-                await callback.message.edit_text(VIDEO_URL_PROMPT, reply_markup=cancel_keyboard)
-                await state.set_state(Form.waiting_for_video_url)
-            elif current_state == Form.waiting_for_video_url.state:
-                await state.update_data(video_url="")
-                form_data = await state.get_data()
-                temp_storage[str(callback.message.message_id)] = {
-                    "message": form_data["title"],
-                    "preview_url": form_data.get("preview_url", ""),
-                    "preview_path": form_data.get("preview_path", ""),
-                    "video_url": form_data["video_url"]
-                }
-                confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📤 Отправить в Discord", callback_data=f"confirm_{callback.message.message_id}")],
-                    [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-                ])
-                await send_preview(callback.message, form_data, confirm_keyboard)
-                await state.set_state(Form.confirming)
-            await callback.answer()
-
-
-        @dp.message(Form.waiting_for_preview)
-        async def process_preview(message: Message, state: FSMContext):
-            if message.from_user.id != TELEGRAM_ADMIN_ID:
-                return
-            preview_url = ""
-            preview_path = ""
-            if message.photo:
-                photo = message.photo[-1]
-                file = await telegram_bot.get_file(photo.file_id)
-                file_path = file.file_path
-                dest_path = os.path.join(TEMP_IMAGE_DIR, f"{photo.file_unique_id}.jpg")
-                await telegram_bot.download_file(file_path, dest_path)
-                preview_path = dest_path
-            elif message.text and message.text.startswith(('http', 'https')):
-                preview_url = message.text
+    @dp.callback_query(F.data == "create_message")
+    async def forward_to_discord(callback: CallbackQuery, state: FSMContext):
+        if callback.from_user.id != TELEGRAM_ADMIN_ID:
+            await callback.answer(NO_PERMS_MESSAGE)
+            logger.info(f"User {callback.from_user.id} does not have permission (Admin ID: {TELEGRAM_ADMIN_ID})")
+            return
+        current_state = await state.get_state()
+        logger.info(f"Current state before transition: {current_state}")
+        await state.clear()
+        try:
+            if callback.message.text:
+                await callback.message.edit_text(TITLE_PROMPT, reply_markup=cancel_keyboard)
             else:
-                await message.answer(INVALID_PREVIEW_MESSAGE)
-                return
-            await state.update_data(preview_url=preview_url, preview_path=preview_path)
-            await message.answer(VIDEO_URL_PROMPT, reply_markup=cancel_keyboard)
-            await state.set_state(Form.waiting_for_video_url)
+                await callback.message.answer(TITLE_PROMPT, reply_markup=cancel_keyboard)
+        except Exception as e:
+            logger.error(f"Error editing message in forward_to_discord: {e}")
+            await callback.message.answer(TITLE_PROMPT, reply_markup=cancel_keyboard)
+        await state.set_state(Form.waiting_for_title)
+        new_state = await state.get_state()
+        logger.info(f"State after transition: {new_state}")
+        await callback.answer()
+
+
+    @dp.message(Form.waiting_for_title)
+    async def process_title(message: Message, state: FSMContext):
+        logger.info(f"Received message in waiting_for_title state: {message.text} from user {message.from_user.id}")
+        if message.from_user.id != TELEGRAM_ADMIN_ID:
+            logger.info(f"User {message.from_user.id} does not have permission (Admin ID: {TELEGRAM_ADMIN_ID})")
+            return
+        await state.update_data(title=message.text[:256] if message.text else "")
+        await message.answer(PREVIEW_PROMPT, reply_markup=cancel_keyboard)
+        await state.set_state(Form.waiting_for_preview)
 
 
-        @dp.message(Form.waiting_for_video_url)
-        async def process_video_url(message: Message, state: FSMContext):
-            if message.from_user.id != TELEGRAM_ADMIN_ID:
-                return
-            if message.text and not message.text.startswith(('http', 'https')):
-                await message.answer(INVALID_URL_MESSAGE)
-                return
-            video_url = message.text if message.text else ""
-            form_data = await state.get_data()
-            preview_url = form_data.get("preview_url", "")
-            preview_path = form_data.get("preview_path", "")
-            if not preview_url and not preview_path and video_url:
-                preview_url = await get_video_preview_url(video_url) or ""
-                await state.update_data(preview_url=preview_url)
-            await state.update_data(video_url=video_url)
+    @dp.callback_query(F.data == "skip")
+    async def skip_step(callback: CallbackQuery, state: FSMContext):
+        if callback.from_user.id != TELEGRAM_ADMIN_ID:
+            await callback.answer(NO_PERMS_MESSAGE)
+            return
+        current_state = await state.get_state()
+        if current_state == Form.waiting_for_title.state:
+            await state.update_data(title="")
+            await callback.message.edit_text(PREVIEW_PROMPT, reply_markup=cancel_keyboard)
+            await state.set_state(Form.waiting_for_preview)
+        elif current_state == Form.waiting_for_preview.state:
+            await state.update_data(preview_url="", preview_id="")
+            await callback.message.edit_text(VIDEO_URL_PROMPT, reply_markup=cancel_keyboard)
+            await state.set_state(Form.waiting_for_video_url)
+        elif current_state == Form.waiting_for_video_url.state:
+            await state.update_data(video_url="")
             form_data = await state.get_data()
-            temp_storage[str(message.message_id)] = {
+            temp_storage.set(str(callback.message.message_id), {
                 "message": form_data["title"],
-                "preview_url": form_data["preview_url"],
-                "preview_path": form_data["preview_path"],
+                "preview_url": form_data.get("preview_url", ""),
+                "preview_id": form_data.get("preview_id", ""),
                 "video_url": form_data["video_url"]
-            }
+            })
             confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="📤 Отправить в Discord", callback_data=f"confirm_{message.message_id}")],
+                [InlineKeyboardButton(text="📤 Отправить в Discord", callback_data=f"confirm_{callback.message.message_id}")],
                 [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
             ])
-            await send_preview(message, form_data, confirm_keyboard)
+            await send_preview(callback.message, form_data, confirm_keyboard)
             await state.set_state(Form.confirming)
+        await callback.answer()
 
 
-        @dp.callback_query(Form.confirming, F.data.startswith("confirm_"))
-        async def confirm_send(callback: CallbackQuery, state: FSMContext):
-            if callback.from_user.id != TELEGRAM_ADMIN_ID:
-                await callback.answer(NO_PERMS_MESSAGE)
-                return
-            try:
-                message_id = callback.data.split("_")[1]
-                form_data = temp_storage.get(message_id)
-                if not form_data:
-                    await callback.answer(DATA_EXPIRED_MESSAGE)
-                    return
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"http://localhost:{PORT}/telegram",
-                        json={
-                            "message": form_data["message"],
-                            "preview_url": form_data["preview_url"],
-                            "preview_path": form_data["preview_path"],
-                            "video_url": form_data["video_url"]
-                        }
-                    ) as resp:
-                        if resp.status == 200:
-                            await callback.answer("✅ Отправлено в Discord!")
-                            if message_id in temp_storage:
-                                del temp_storage[message_id]
-                        else:
-                            error_text = await resp.text()
-                            logger.error(f"Ошибка при отправке в Discord: {resp.status} - {error_text}")
-                            await callback.answer("❌ Ошибка отправки в Discord.")
-                await state.clear()
-                success_message = "Сообщение отправлено в Discord. Используйте /start для новой отправки."
+    @dp.message(Form.waiting_for_preview)
+    async def process_preview(message: Message, state: FSMContext):
+        if message.from_user.id != TELEGRAM_ADMIN_ID:
+            return
+        preview_url = ""
+        preview_id = ""
+        if message.photo:
+            photo = message.photo[-1]
+            preview_id = f"{photo.file_unique_id}-{message.message_id}"
+            filename = f"{preview_id}.jpg"
+            size = photo.file_size
+            if size and preview_store.reserve_memory(size):
                 try:
-                    if callback.message.text:
-                        await callback.message.edit_text(success_message, reply_markup=start_keyboard)
-                    elif callback.message.photo:
-                        await callback.message.edit_caption(caption=success_message, reply_markup=start_keyboard)
-                    else:
-                        await callback.message.answer(success_message, reply_markup=start_keyboard)
-                except Exception as e:
-                    logger.error(f"Error editing message: {e}")
-                    await callback.message.answer(success_message, reply_markup=start_keyboard)
-            except Exception as e:
-                logger.error(f"Ошибка отправки из Telegram в Discord: {e}")
-                await callback.answer("❌ Ошибка.")
+                    buffer = await telegram_bot.download(photo, destination=io.BytesIO())
+                except Exception:
+                    preview_store.cancel_reservation(size)
+                    raise
+                preview_store.add(Preview(preview_id, filename, data=buffer.getvalue()), reserved=size)
+            else:
+                dest_path = preview_store.spill_path(preview_id)
+                await telegram_bot.download(photo, destination=dest_path)
+                preview_store.add(Preview(preview_id, filename, path=dest_path))
+        elif message.text and message.text.startswith(('http', 'https')):
+            preview_url = message.text
+        else:
+            await message.answer(INVALID_PREVIEW_MESSAGE)
+            return
+        await state.update_data(preview_url=preview_url, preview_id=preview_id)
+        await message.answer(VIDEO_URL_PROMPT, reply_markup=cancel_keyboard)
+        await state.set_state(Form.waiting_for_video_url)
+
 
+    @dp.message(Form.waiting_for_video_url)
+    async def process_video_url(message: Message, state: FSMContext):
+        if message.from_user.id != TELEGRAM_ADMIN_ID:
+            return
+        if message.text and not message.text.startswith(('http', 'https')):
+            await message.answer(INVALID_URL_MESSAGE)
+            return
+        video_url = message.text if message.text else ""
+        form_data = await state.get_data()
+        preview_url = form_data.get("preview_url", "")
+        preview_id = form_data.get("preview_id", "")
+        if not preview_url and not preview_id and video_url:
+            preview_url = await get_video_preview_url(video_url) or ""
+            await state.update_data(preview_url=preview_url)
+        await state.update_data(video_url=video_url)
+        form_data = await state.get_data()
+        temp_storage.set(str(message.message_id), {
+            "message": form_data["title"],
+            "preview_url": form_data["preview_url"],
+            "preview_id": form_data.get("preview_id", ""),
+            "video_url": form_data["video_url"]
+        })
+        confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📤 Отправить в Discord", callback_data=f"confirm_{message.message_id}")],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+        ])
+        await send_preview(message, form_data, confirm_keyboard)
+        await state.set_state(Form.confirming)
 
-        @dp.callback_query(F.data == "cancel")
-        async def cancel_callback(callback: CallbackQuery, state: FSMContext):
+
+    @dp.callback_query(Form.confirming, F.data.startswith("confirm_"))
+    async def confirm_send(callback: CallbackQuery, state: FSMContext):
+        if callback.from_user.id != TELEGRAM_ADMIN_ID:
+            await callback.answer(NO_PERMS_MESSAGE)
+            return
+        try:
+            message_id = callback.data.split("_")[1]
+            form_data = temp_storage.get(message_id, None)
+            if not form_data:
+                await callback.answer(DATA_EXPIRED_MESSAGE)
+                return
+            job = NewsJob.from_dict(form_data)
+            delivery = await deliver_news(job)
+            if delivery.ok:
+                await callback.answer("✅ Отправлено в Discord!")
+                temp_storage.pop(message_id)
+            else:
+                logger.error(f"Ошибка при отправке в Discord: {delivery.status} - {delivery.error}")
+                await callback.answer("❌ Ошибка отправки в Discord.")
             await state.clear()
+            success_message = "Сообщение отправлено в Discord. Используйте /start для новой отправки."
             try:
                 if callback.message.text:
-                    await callback.message.edit_text(CANCEL_MESSAGE, reply_markup=start_keyboard)
+                    await callback.message.edit_text(success_message, reply_markup=start_keyboard)
+                elif callback.message.photo:
+                    await callback.message.edit_caption(caption=success_message, reply_markup=start_keyboard)
                 else:
-                    await callback.message.answer(CANCEL_MESSAGE, reply_markup=start_keyboard)
+                    await callback.message.answer(success_message, reply_markup=start_keyboard)
             except Exception as e:
                 logger.error(f"Error editing message: {e}")
+                await callback.message.answer(success_message, reply_markup=start_keyboard)
+        except Exception as e:
+            logger.error(f"Ошибка отправки из Telegram в Discord: {e}")
+            await callback.answer("❌ Ошибка.")
+
+
+    @dp.callback_query(F.data == "cancel")
+    async def cancel_callback(callback: CallbackQuery, state: FSMContext):
+        await clear_form(state)
+        try:
+            if callback.message.text:
+                await callback.message.edit_text(CANCEL_MESSAGE, reply_markup=start_keyboard)
+            else:
                 await callback.message.answer(CANCEL_MESSAGE, reply_markup=start_keyboard)
-            await callback.answer()
+        except Exception as e:
+            logger.error(f"Error editing message: {e}")
+            await callback.message.answer(CANCEL_MESSAGE, reply_markup=start_keyboard)
+        await callback.answer()
 
-        await dp.start_polling(telegram_bot)
+    await dp.start_polling(telegram_bot, handle_signals=False)
 
-    asyncio.run(telegram_main())
 
+async def process_twitch_statuses(statuses: dict[str, bool | None]) -> list[str]:
+    detected_at = time.monotonic()
+    announced = []
+    for username, is_live in statuses.items():
+        if is_live is None:
+            continue
+        if is_live and (not twitch_live_status.get(username) or live_updater.restarted(username)):
+            if twitch_live_status.get(username):
+                logger.info("Twitch стрим перезапущен: %s", username)
+                twitch_live_status[username] = False
+                await live_updater.finish(username)
+            result = await send_twitch_notification(username, detected_at)
+            if result.delivered:
+                announced.append(username)
+        elif is_live:
+            await live_updater.refresh(username)
+        elif twitch_live_status.get(username):
+            logger.info("Twitch стрим закончен: %s", username)
+            twitch_live_status[username] = False
+            await live_updater.finish(username)
+            twitch_streams.pop(username, None)
+    await update_presence([username for username in TWITCH_USERNAMES if twitch_live_status.get(username)])
+    return announced
+
+
+async def poll_youtube(feeds: list[str] | None = None, since: float | None = None) -> dict[str, bool | None]:
+    if not has_target_channel(YOUTUBE_TARGET_CHANNEL_IDS):
+        logger.warning(f"Ни один канал YouTube не найден (ID: {YOUTUBE_TARGET_CHANNEL_IDS})")
+        return {}
+    feeds = list(YOUTUBE_FEEDS if feeds is None else feeds)
+    new_videos, failed = await get_latest_youtube_video(feeds=feeds, since=since)
+    for new_video in new_videos:
+        await send_youtube_notification(new_video)
+    if not new_videos:
+        logger.debug("Видео не обновлялось с последней проверки.")
+    updated = {video["source"] for video in new_videos}
+    return {url: None if url in failed else url in updated for url in feeds}
+
+
+async def poll_twitch(usernames: list[str] | None = None) -> dict[str, bool | None]:
+    if not has_target_channel(TWITCH_TARGET_CHANNEL_IDS):
+        logger.warning(f"Ни один канал Twitch не найден (ID: {TWITCH_TARGET_CHANNEL_IDS})")
+        return {}
+    statuses = await liveness_provider.check(TWITCH_USERNAMES if usernames is None else usernames)
+    await process_twitch_statuses(statuses)
+    return statuses
+
+
+class PollSource:
+    def __init__(self, kind: str, key: str, activity: list | None = None):
+        self.kind = kind
+        self.key = key
+        self.source_id = f"{kind}:{key}"
+        if kind == "youtube" and WEBSUB_CALLBACK_URL:
+            self.base_interval = self.min_interval = self.max_interval = WEBSUB_RECONCILE_MINUTES * 60
+        else:
+            self.base_interval = CHECK_INTERVAL_MINUTES * 60
+            self.min_interval = POLL_MIN_SECONDS
+            self.max_interval = POLL_MAX_SECONDS
+        self.interval = self.base_interval
+        self.activity = list(activity or [])[-POLL_ACTIVITY_HISTORY:]
+        self.hot_hours = self.find_hot_hours()
+        self.next_due = time.monotonic() + random.uniform(0, self.min_interval)
+        self.running = False
+
+    def find_hot_hours(self) -> set[int]:
+        counts = {}
+        for hour in self.activity:
+            counts[hour] = counts.get(hour, 0) + 1
+        scores = {}
+        for hour_of_week in range(168):
+            score = 0
+            for hour, count in counts.items():
+                distance = abs(hour - hour_of_week) % 168
+                if min(distance, 168 - distance) <= POLL_HOT_WINDOW_HOURS:
+                    score += count
+            if score >= POLL_HOT_MIN_EVENTS:
+                scores[hour_of_week] = score
+        return set(sorted(scores, key=scores.get, reverse=True)[:int(168 * POLL_HOT_MAX_SHARE)])
+
+    def is_hot(self, hour_of_week: int) -> bool:
+        return hour_of_week in self.hot_hours
+
+    def record(self, event: bool = False, busy: bool = False, failed: bool = False):
+        now = dt.datetime.now(dt.UTC)
+        hour_of_week = now.weekday() * 24 + now.hour
+        if event:
+            self.activity = (self.activity + [hour_of_week])[-POLL_ACTIVITY_HISTORY:]
+            self.hot_hours = self.find_hot_hours()
+            self.interval = self.min_interval
+        elif busy or failed:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.max_interval, max(self.interval, self.min_interval) * POLL_BACKOFF)
+        if self.is_hot(hour_of_week):
+            self.interval = self.min_interval
+        self.next_due = time.monotonic() + self.interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+class PollScheduler:
+    def __init__(self):
+        self.sources: dict[tuple[str, str], PollSource] = {}
+        self.task = None
+        self.polls = set()
+        self.wake = asyncio.Event()
+
+    def sync_sources(self):
+        wanted = {("youtube", url) for url in YOUTUBE_FEEDS} | {("twitch", name) for name in TWITCH_USERNAMES}
+        for kind, key in wanted - self.sources.keys():
+            self.sources[(kind, key)] = PollSource(kind, key, poll_activity.get(f"{kind}:{key}"))
+        for source_id in self.sources.keys() - wanted:
+            del self.sources[source_id]
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.sync_sources()
+            self.task = asyncio.create_task(self.run())
+
+    def poll_now(self):
+        for source in self.sources.values():
+            source.next_due = time.monotonic()
+        self.wake.set()
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            due = []
+            for source in self.sources.values():
+                if source.next_due > now or source.running:
+                    continue
+                if coordinator.owns(source.source_id):
+                    due.append(source)
+                else:
+                    source.next_due = now + source.interval
+            youtube = [source for source in due if source.kind == "youtube"]
+            twitch = [source for source in due if source.kind == "twitch"]
+            if youtube:
+                self.launch(self.poll_youtube_sources(youtube), youtube)
+            if twitch:
+                self.launch(self.poll_twitch_sources(twitch), twitch)
+            waiting = [source.next_due for source in self.sources.values() if not source.running]
+            delay = max(0.5, min(waiting) - time.monotonic()) if waiting else 1
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def launch(self, coro, sources: list[PollSource]):
+        for source in sources:
+            source.running = True
+        task = asyncio.create_task(coro)
+        self.polls.add(task)
+        task.add_done_callback(self.polls.discard)
+        task.add_done_callback(lambda _: self.finish(sources))
+
+    def finish(self, sources: list[PollSource]):
+        for source in sources:
+            source.running = False
+        self.wake.set()
+
+    async def poll_youtube_sources(self, sources: list[PollSource]):
+        try:
+            statuses = await poll_youtube([source.key for source in sources])
+        except Exception as e:
+            logger.error(f"Ошибка опроса YouTube: {e}", exc_info=True)
+            for source in sources:
+                source.record(failed=True)
+            return
+        for source in sources:
+            updated = statuses.get(source.key)
+            source.record(event=bool(updated), failed=updated is None)
+        self.save_activity(sources)
 
-@tasks.loop(minutes=CHECK_INTERVAL_MINUTES)
-async def check_updates():
-    global twitch_stream_live
-    max_retries = 3
-    for attempt in range(max_retries):
+    async def poll_twitch_sources(self, sources: list[PollSource]):
         try:
-            yt_channel = bot.get_channel(YOUTUBE_CHANNEL_ID)
-            tw_channel = bot.get_channel(TWITCH_CHANNEL_ID)
-            if yt_channel is None:
-                logger.warning(f"Канал YouTube не найден (ID: {YOUTUBE_CHANNEL_ID})")
-            else:
-                new_video = await get_latest_youtube_video()
-                if new_video:
-                    await send_youtube_notification(yt_channel, new_video)
-                else:
-                    logger.info("Видео не обновлялось с последней проверки.")
-            if tw_channel is None:
-                logger.warning(f"Канал Twitch не найден (ID: {TWITCH_CHANNEL_ID})")
-            else:
-                is_live = await is_twitch_stream_live()
-                if is_live and not twitch_stream_live:
-                    await send_twitch_notification(tw_channel)
-                elif not is_live:
-                    logger.info("Twitch стрим закончен.")
-                    twitch_stream_live = False
-                await update_presence(is_live)
-            break
+            previous = {source.key: twitch_live_status.get(source.key) for source in sources}
+            statuses = await poll_twitch([source.key for source in sources])
         except Exception as e:
-            logger.error(f"Error in check_updates (attempt {attempt + 1}/{max_retries}): {e}", exc_info=True)
-            if attempt < max_retries - 1:
-                await asyncio.sleep(5)
-            else:
-                logger.error("Max retries reached in check_updates. Task failed.")
+            logger.error(f"Ошибка опроса Twitch: {e}", exc_info=True)
+            for source in sources:
+                source.record(failed=True)
+            return
+        for source in sources:
+            is_live = statuses.get(source.key)
+            source.record(event=bool(is_live) and not previous[source.key], busy=bool(is_live), failed=is_live is None)
+        self.save_activity(sources)
+
+    def save_activity(self, sources: list[PollSource]):
+        changed = False
+        for source in sources:
+            if poll_activity.get(source.source_id) != source.activity:
+                poll_activity[source.source_id] = list(source.activity)
+                changed = True
+        if changed:
+            state_store.put_many({"poll_activity": {key: list(value) for key, value in poll_activity.items()}})
+
+
+scheduler = PollScheduler()
+
+
+async def coordination_loop():
+    while True:
+        await asyncio.sleep(coordinator.ttl / 3)
+        if await coordinator.refresh():
+            scheduler.poll_now()
+
+
+@tasks.loop(minutes=10)
+async def sweep_previews():
+    removed = await asyncio.to_thread(preview_store.sweep)
+    if removed:
+        logger.info(f"Очищено устаревших превью: {removed}")
 
 
 @bot.command(name="help")
@@ -586,24 +2897,24 @@ async def custom_help(ctx):
 
 @bot.command(name="проверка")
 async def manual_check(ctx):
-    global twitch_stream_check
     await ctx.send("🔍 Проверка обновлений...")
-    yt_channel = bot.get_channel(YOUTUBE_CHANNEL_ID)
-    twitch_channel = bot.get_channel(TWITCH_CHANNEL_ID)
-    if yt_channel is None or twitch_channel is None:
+    if not has_target_channel(YOUTUBE_TARGET_CHANNEL_IDS) or (ENABLE_TWITCH and not has_target_channel(TWITCH_TARGET_CHANNEL_IDS)):
         await ctx.send("❌ Не могу получить нужные каналы для уведомлений.")
         return
-    new_video = await get_latest_youtube_video()
-    if new_video and yt_channel:
-        await send_youtube_notification(yt_channel, new_video)
+    new_videos, _ = await get_latest_youtube_video()
+    for new_video in new_videos:
+        await send_youtube_notification(new_video)
+    if new_videos:
         await ctx.send("✅ Видео найдено и отправлено.")
     else:
         await ctx.send("ℹ️ Новых видео не найдено.")
-    is_live = await is_twitch_stream_live()
-    if is_live and not twitch_stream_check and twitch_channel:
-        await send_twitch_notification(twitch_channel)
-        await ctx.send("📡 Стрим в эфире! Уведомление отправлено.")
-    elif is_live:
+    if not ENABLE_TWITCH:
+        return
+    statuses = await liveness_provider.check(TWITCH_USERNAMES)
+    announced = await process_twitch_statuses(statuses)
+    if announced:
+        await ctx.send(f"📡 Стрим в эфире! Уведомление отправлено: {', '.join(announced)}.")
+    elif any(statuses.values()):
         await ctx.send("📡 Стрим уже идёт.")
     else:
         await ctx.send("📴 Стрим сейчас не идёт.")
@@ -611,13 +2922,12 @@ async def manual_check(ctx):
 
 @bot.command(name="testvideo", aliases=["тествидео"])
 async def test_video(ctx):
-    yt_channel = bot.get_channel(YOUTUBE_CHANNEL_ID)
-    if yt_channel:
+    if resolve_channel(YOUTUBE_CHANNEL_ID):
         fake_video = {
             "title": "🎬 Тестовое видео: Камыш возвращается!",
             "link": "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
         }
-        await send_youtube_notification(yt_channel, fake_video)
+        await send_youtube_notification(fake_video, [YOUTUBE_CHANNEL_ID], dedupe=False)
         await ctx.send("✅ Тестовое видео отправлено.")
     else:
         await ctx.send("❌ Канал YouTube не найден.")
@@ -625,9 +2935,8 @@ async def test_video(ctx):
 
 @bot.command(name="teststream", aliases=["тестстрим"])
 async def test_stream(ctx):
-    twitch_channel = bot.get_channel(TWITCH_CHANNEL_ID)
-    if twitch_channel:
-        await send_twitch_notification(twitch_channel)
+    if resolve_channel(TWITCH_CHANNEL_ID):
+        await send_twitch_notification(channel_ids=[TWITCH_CHANNEL_ID], dedupe=False)
         await ctx.send("📡 Тестовое уведомление о стриме отправлено.")
     else:
         await ctx.send("❌ Канал Twitch не найден.")
@@ -635,23 +2944,62 @@ async def test_stream(ctx):
 
 @bot.event
 async def on_ready():
-    global http_session
-    if http_session is None:
-        http_session = aiohttp.ClientSession()
+    first_ready = loop_lag_task is None
+    if first_ready:
+        startup_timings.append(("discord login + gateway", time.perf_counter() - discord_connect_started))
     logger.info(f"✅ Бот {bot.user} запущен!")
-    if not check_updates.is_running():
-        check_updates.start()
-    bot.loop.create_task(run_webserver())
+    await start_services()
+    if PROFILE_STARTUP and first_ready:
+        log_startup_profile()
 
 
-async def update_presence(is_live: bool):
+async def start_services():
+    global http_session, send_lock, twitch_executor, feed_parse_executor, loop_lag_task, coordination_task
+    if send_lock is None:
+        send_lock = asyncio.Lock()
+    if http_session is None:
+        http_session = create_http_session()
+    if ENABLE_TWITCH and twitch_executor is None:
+        twitch_executor = ThreadPoolExecutor(max_workers=TWITCH_CHECK_WORKERS, thread_name_prefix="twitch-check")
+    if feed_parse_executor is None:
+        feed_parse_executor = ThreadPoolExecutor(max_workers=RSS_PARSE_WORKERS, thread_name_prefix="feed-parse")
+    state_store.bind(asyncio.get_running_loop())
+    dispatcher.start()
+    if not sweep_previews.is_running():
+        sweep_previews.start()
+    if coordination_task is None:
+        await coordinator.refresh()
+        coordination_task = asyncio.create_task(coordination_loop())
+    scheduler.start()
+    if loop_lag_task is None:
+        loop_lag_task = asyncio.create_task(loop_watchdog.run())
+    services_started.set()
+
+
+async def run_notifier():
+    await start_services()
+    logger.info(f"✅ Уведомитель запущен без подключения к Discord ({len(webhook_channels)} вебхуков)")
+    if PROFILE_STARTUP:
+        log_startup_profile()
+    await asyncio.Event().wait()
+
+
+def log_startup_profile():
+    lines = [f"  {name:<36} {seconds * 1000:9.1f} мс" for name, seconds in startup_timings]
+    lines.append(f"  {'всего до готовности':<36} {(time.perf_counter() - STARTUP_STARTED) * 1000:9.1f} мс")
+    logger.info("Профиль запуска:\n" + "\n".join(lines))
+
+
+async def update_presence(live_usernames: list[str]):
+    if not DISCORD_GATEWAY:
+        return
     try:
-        if is_live:
-            activity = disnake.Activity(type=disnake.ActivityType.watching, name=TWITCH_USERNAME)
+        if live_usernames:
+            activity = disnake.Activity(type=disnake.ActivityType.watching, name=", ".join(live_usernames))
         else:
             activity = None
         await bot.change_presence(activity=activity)
-        logger.info(f"Обновлена активность: {'Смотрит ' + TWITCH_USERNAME if is_live else 'нет активности'}")
+        logger.debug("Обновлена активность: %s", live_usernames or "нет активности")
     except Exception as e:
         logger.error(f"Ошибка обновления активности: {e}")
 
@@ -660,94 +3008,343 @@ async def handle(request):
     return web.Response(text="ОК")
 
 
-async def telegram_news_handler(request):
+async def deliver_news(job: NewsJob) -> NewsDelivery:
     try:
-        data = await request.json()
-        logger.info(f"Получен запрос от Telegram: {data}")
-        channel = bot.get_channel(YOUTUBE_CHANNEL_ID)
-        if not channel:
-            logger.error(f"Канал Discord не найден (ID: {YOUTUBE_CHANNEL_ID})")
-            return web.Response(status=404, text=DISCORD_CHANNEL_ERROR)
-        
-        message = data.get("message") or DEFAULT_MESSAGE
-        embed = disnake.Embed(
-            title=message,
-            color=disnake.Color.from_rgb(229, 57, 53),
-            timestamp=dt.datetime.now(dt.UTC)
-        )
+        if not has_target_channel(NEWS_TARGET_CHANNEL_IDS):
+            logger.error(f"Канал Discord не найден (ID: {NEWS_TARGET_CHANNEL_IDS})")
+            return NewsDelivery(False, 404, DISCORD_CHANNEL_ERROR)
         
-        preview_url = data.get("preview_url")
-        preview_path = data.get("preview_path")
-        video_url = data.get("video_url")
-        files = []
-
-        if preview_path and os.path.exists(preview_path):
-            filename = os.path.basename(preview_path)
-            embed.set_image(url=f"attachment://{filename}")
-            files.append(disnake.File(preview_path, filename=filename))
+        preview_url = job.preview_url
+        preview_path = job.preview_path
+        video_url = job.video_url
+        make_files = list
+        image = None
+        embed_url = None
+
+        preview = preview_store.get(job.preview_id)
+        if preview is None and preview_path and await asyncio.to_thread(os.path.isfile, preview_path):
+            preview = Preview(preview_path, os.path.basename(preview_path), path=preview_path)
+        if preview:
+            data = await asyncio.to_thread(preview.read)
+            image = f"attachment://{preview.filename}"
+            make_files = lambda: [disnake.File(io.BytesIO(data), filename=preview.filename)]
         elif preview_url and await is_image_available(preview_url):
-            embed.set_image(url=preview_url)
-            if video_url:
-                embed.url = video_url
+            image = preview_url
+            embed_url = video_url
         elif video_url:
             video_id = extract_video_id(video_url)
             if video_id:
-                thumbnail = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-                if await is_image_available(thumbnail):
-                    embed.url = video_url
-                    embed.set_image(url=thumbnail)
+                thumbnail = await resolve_youtube_thumbnail(video_id)
+                if thumbnail:
+                    embed_url = video_url
+                    image = thumbnail
                 else:
-                    thumbnail = f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-                    if await is_image_available(thumbnail):
-                        embed.url = video_url
-                        embed.set_image(url=thumbnail)
-                    else:
-                        logger.warning(f"Не удалось загрузить превью для видео {video_url} (ID: {video_id}).")
+                    logger.warning(f"Не удалось загрузить превью для видео {video_url} (ID: {video_id}).")
         
-        view = create_social_buttons(video_url or "")
+        embed = templates.render("news", title=job.message or DEFAULT_MESSAGE, url=embed_url, image=image)
+        content = templates.content("news")
         
-        await channel.send(content="@everyone", embed=embed, view=view, files=files)
+        result = await fan_out(
+            f"news:{job.preview_id or job.message}", "news", NEWS_TARGET_CHANNEL_IDS, PRIORITY_NEWS,
+            lambda channel: {"content": content, "embed": embed, "components": create_social_buttons(video_url or "", channel), "files": make_files()}
+        )
+        if not result.delivered:
+            return NewsDelivery(False, 500, SEND_ERROR_MESSAGE)
         logger.info("📢 Сообщение из Telegram отправлено в Discord с упоминанием!")
-        
-        if preview_path and os.path.exists(preview_path):
-            try:
-                os.remove(preview_path)
-                logger.info(f"Удалён временный файл: {preview_path}")
-            except Exception as e:
-                logger.error(f"Ошибка при удалении файла {preview_path}: {e}")
-                
-        return web.Response(text=WEB_SERVER_RESPONSE)
+        await asyncio.to_thread(preview_store.release, job.preview_id)
+        if preview_path:
+            await asyncio.to_thread(remove_file, preview_path)
+        return NewsDelivery(True)
+    except Exception as e:
+        logger.error(f"Ошибка при отправке новости: {e}", exc_info=True)
+        return NewsDelivery(False, 500, WEB_SERVER_ERROR)
+
+
+async def telegram_news_handler(request):
+    try:
+        data = await request.json()
+        logger.debug("Получен запрос от Telegram: %s", data)
+        job = NewsJob.from_dict(data)
     except Exception as e:
         logger.error(f"Ошибка при обработке запроса: {e}", exc_info=True)
-        return web.Response(status=500, text=WEB_SERVER_ERROR)
+        return web.Response(status=400, text=WEB_SERVER_ERROR)
+    delivery = await deliver_news(job)
+    if delivery.ok:
+        return web.Response(text=WEB_SERVER_RESPONSE)
+    return web.Response(status=delivery.status, text=delivery.error)
+
+
+def websub_topic(feed_url: str) -> str:
+    return feed_url.replace("youtube.com/feeds/videos.xml", "youtube.com/xml/feeds/videos.xml", 1)
+
+
+def websub_feed_url(topic: str) -> str | None:
+    for feed_url in YOUTUBE_FEEDS:
+        if topic in (feed_url, websub_topic(feed_url)):
+            return feed_url
+    return None
+
+
+async def websub_subscribe(feed_url: str, mode: str = "subscribe") -> bool:
+    data = {
+        "hub.callback": WEBSUB_CALLBACK_URL,
+        "hub.mode": mode,
+        "hub.topic": websub_topic(feed_url),
+        "hub.verify": "async",
+        "hub.lease_seconds": str(WEBSUB_LEASE_SECONDS)
+    }
+    if websub_secret:
+        data["hub.secret"] = websub_secret
+    try:
+        async with http_session.post(WEBSUB_HUB_URL, data=data, timeout=http_timeout(WEBSUB_TIMEOUT)) as resp:
+            if resp.status in (202, 204):
+                return True
+            logger.warning(f"WebSub хаб отклонил подписку на {feed_url}: {resp.status} {await resp.text()}")
+    except Exception as e:
+        logger.error(f"Ошибка подписки WebSub на {feed_url}: {e}")
+    return False
+
+
+async def websub_renewal_loop():
+    while True:
+        now = time.time()
+        for feed_url in YOUTUBE_FEEDS:
+            expires_at = websub_leases.get(websub_topic(feed_url), 0)
+            if expires_at - now < WEBSUB_LEASE_SECONDS * 0.1:
+                if await websub_subscribe(feed_url):
+                    websub_leases.setdefault(websub_topic(feed_url), now + 600)
+        await asyncio.sleep(max(60, min(600, WEBSUB_LEASE_SECONDS * 0.05)))
+
+
+async def websub_verify_handler(request):
+    mode = request.query.get("hub.mode")
+    topic = request.query.get("hub.topic", "")
+    challenge = request.query.get("hub.challenge")
+    if not challenge or mode not in ("subscribe", "unsubscribe", "denied"):
+        return web.Response(status=400)
+    if mode == "denied":
+        logger.warning(f"WebSub хаб отказал в подписке на {topic}: {request.query.get('hub.reason', '')}")
+        websub_leases.pop(topic, None)
+        return web.Response(text="")
+    if mode == "subscribe" and not websub_feed_url(topic):
+        return web.Response(status=404)
+    if mode == "subscribe":
+        lease_seconds = int(request.query.get("hub.lease_seconds", WEBSUB_LEASE_SECONDS))
+        websub_leases[topic] = time.time() + lease_seconds
+        logger.info(f"WebSub подписка подтверждена: {topic} на {lease_seconds} с")
+    else:
+        websub_leases.pop(topic, None)
+    return web.Response(text=challenge)
+
+
+def websub_signature_valid(body: bytes, header: str) -> bool:
+    if not websub_secret:
+        return True
+    method, _, signature = header.partition("=")
+    if method not in ("sha1", "sha256", "sha384", "sha512"):
+        return False
+    expected = hmac.new(websub_secret.encode(), body, getattr(hashlib, method)).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+async def websub_notify_handler(request):
+    body = await request.read()
+    if not websub_signature_valid(body, request.headers.get("X-Hub-Signature", "")):
+        logger.warning("WebSub уведомление с неверной подписью отклонено")
+        return web.Response(status=202)
+    topic = ""
+    for link in request.headers.getall("Link", []):
+        for part in link.split(","):
+            if 'rel="self"' in part or "rel=self" in part:
+                topic = part.split(";")[0].strip().strip("<>")
+    task = asyncio.create_task(process_websub_push(topic, body))
+    websub_tasks.add(task)
+    task.add_done_callback(websub_tasks.discard)
+    return web.Response(status=204)
+
+
+async def process_websub_push(topic: str, body: bytes):
+    try:
+        feed = parse_feed_body(body)
+        if not topic:
+            topic = feed.self_url
+        feed_url = websub_feed_url(topic)
+        if not feed_url:
+            logger.warning(f"WebSub уведомление для неизвестной ленты: {topic}")
+            return
+        max_age = WEBSUB_MAX_VIDEO_AGE_HOURS * 3600
+        if not seen_videos.has_source(feed_url):
+            pushed = [published_at(entry) for entry in feed.entries if (published_age(entry) or max_age + 1) <= max_age]
+            logger.info(f"WebSub уведомление для ещё не опрошенной ленты {feed_url}, выполняется полный опрос")
+            await poll_youtube([feed_url], since=min(pushed) if pushed else None)
+            return
+        new_videos = find_new_feed_videos(feed_url, feed, max_age=max_age)
+        save_state()
+        if not new_videos:
+            return
+        for video in new_videos:
+            await send_youtube_notification(video)
+    except Exception as e:
+        logger.error(f"Ошибка обработки WebSub уведомления: {e}", exc_info=True)
+
+
+async def deliveries_handler(request):
+    return web.json_response([result.to_dict() for result in reversed(delivery_log)])
+
+
+async def metrics_handler(request):
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def health_handler(request):
+    stalls = loop_watchdog.recent_stalls(HEALTH_STALL_WINDOW)
+    gateway_ready = bot.is_ready() if DISCORD_GATEWAY else None
+    healthy = not stalls and gateway_ready is not False
+    return web.json_response({
+        "status": "ok" if healthy else "degraded",
+        "instance": INSTANCE_ID,
+        "uptime_seconds": time.perf_counter() - STARTUP_STARTED,
+        "discord_gateway": {"ready": gateway_ready, "latency": bot.latency if gateway_ready else None},
+        "event_loop": {
+            "lag_seconds": loop_watchdog.lag,
+            "max_lag_seconds": loop_watchdog.max_lag,
+            "threshold_seconds": loop_watchdog.threshold,
+            "stalls_total": loop_watchdog.stall_count,
+            "recent_stalls": stalls
+        },
+        "dispatch_queue_depth": dispatcher.depth(),
+        "poller_leader": coordinator.leader
+    }, status=200 if healthy else 503)
 
 
 async def run_webserver():
+    global webserver_runner
+    await services_started.wait()
     app = web.Application()
     app.add_routes([
         web.get('/', handle),
-        web.post('/telegram', telegram_news_handler)
+        web.post('/telegram', telegram_news_handler),
+        web.get('/websub', websub_verify_handler),
+        web.post('/websub', websub_notify_handler),
+        web.get('/metrics', metrics_handler),
+        web.get('/deliveries', deliveries_handler),
+        web.get('/health', health_handler)
     ])
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', PORT)
-    await site.start()
-    logger.info(f"🌐 HTTP сервер запущен на порту {PORT}")
+    webserver_runner = web.AppRunner(app)
+    await webserver_runner.setup()
+    try:
+        site = web.TCPSite(webserver_runner, '0.0.0.0', PORT)
+        await site.start()
+        logger.info(f"🌐 HTTP сервер запущен на порту {PORT}")
+        await (websub_renewal_loop() if WEBSUB_CALLBACK_URL else asyncio.Event().wait())
+    except Exception:
+        await close_webserver()
+        raise
+
+
+async def close_webserver():
+    global webserver_runner
+    if webserver_runner:
+        await webserver_runner.cleanup()
+    webserver_runner = None
 
 
 async def close_http_session():
     global http_session
-    if http_session:
+    if http_session and not http_session.closed:
         await http_session.close()
+        await asyncio.sleep(0.25)
+    http_session = None
+
+
+def shutdown_executors():
+    for executor in (twitch_executor, feed_parse_executor):
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_discord():
+    global discord_connect_started
+    if bot.is_closed():
+        bot.clear()
+    discord_connect_started = time.perf_counter()
+    try:
+        await bot.start(DISCORD_TOKEN)
+    finally:
+        if not bot.is_closed():
+            await bot.close()
+
+
+async def supervise(name: str, run, fatal: tuple = ()):
+    delay = SUPERVISOR_RESTART_DELAY
+    while True:
+        started = time.monotonic()
+        try:
+            await run()
+            logger.info("Сервис %s остановлен", name)
+            return
+        except fatal:
+            raise
+        except Exception as e:
+            logger.error("Сервис %s упал: %s", name, e, exc_info=True)
+        if time.monotonic() - started > SUPERVISOR_RESTART_MAX_DELAY:
+            delay = SUPERVISOR_RESTART_DELAY
+        logger.info("Перезапуск %s через %.0f с", name, delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, SUPERVISOR_RESTART_MAX_DELAY)
+
+
+async def shutdown():
+    logger.info("Остановка бота...")
+    if DISCORD_GATEWAY and not bot.is_closed():
+        await bot.close()
+    sweep_previews.cancel()
+    background = [task for task in (scheduler.task, *scheduler.polls, *live_updater.deferred.values(), coordination_task, loop_lag_task, *websub_tasks) if task]
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await close_webserver()
+    await dispatcher.stop()
+    loop_watchdog.stop()
+    state_store.close()
+    coordinator.close()
+    shutdown_executors()
+    await close_http_session()
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, main_task.cancel)
+    try:
+        async with asyncio.TaskGroup() as group:
+            if DISCORD_GATEWAY:
+                group.create_task(supervise("discord", run_discord, (disnake.LoginFailure,)))
+            else:
+                group.create_task(supervise("notifier", run_notifier))
+            if ENABLE_TELEGRAM:
+                group.create_task(supervise("telegram", run_telegram_bot))
+            if ENABLE_WEBSERVER:
+                group.create_task(supervise("webserver", run_webserver))
+    finally:
+        await shutdown()
 
 
 if __name__ == "__main__":
-    if not all([DISCORD_TOKEN, TELEGRAM_TOKEN]):
+    if (DISCORD_GATEWAY and not DISCORD_TOKEN) or (ENABLE_TELEGRAM and not TELEGRAM_TOKEN):
         logger.error("❌ Не указаны необходимые переменные окружения (DISCORD_TOKEN, TELEGRAM_TOKEN).")
         exit(1)
-    load_state()
-    threading.Thread(target=start_telegram_bot, daemon=True).start()
+    if DELIVERY_BACKEND == "webhook" and not webhook_channels:
+        logger.error(f"❌ DELIVERY_BACKEND=webhook, но в {WEBHOOKS_FILE} нет вебхуков.")
+        exit(1)
+    if not DISCORD_GATEWAY and DELIVERY_BACKEND != "webhook":
+        logger.error("❌ Без подключения к Discord (DISCORD_GATEWAY=0) нужен DELIVERY_BACKEND=webhook.")
+        exit(1)
+    with startup_step("load state"):
+        load_state()
     try:
-        bot.run(DISCORD_TOKEN)
-    finally:
-        asyncio.run(close_http_session())
\ No newline at end of file
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
\ No newline at end of file
@@ -0,0 +1,366 @@
+import re
+import sys
+import hmac
+import json
+import time
+import zlib
+import asyncio
+import itertools
+import hashlib
+import secrets
+import argparse
+import datetime as dt
+from xml.sax.saxutils import escape
+import aiohttp
+from aiohttp import web
+
+
+TWITCH_GQL_USER_RE = re.compile(r'(\w+):\s*user\(login:\s*"([^"]+)"\)')
+
+
+def create_twitch_app(live_usernames: set[str] | None = None, latency: float = 0.0) -> web.Application:
+    app = web.Application()
+    app["live_usernames"] = {name.lower() for name in live_usernames or ()}
+    app["titles"] = {}
+    app["started_at"] = {}
+    app["requests"] = 0
+    app["tokens"] = set()
+    app["token_requests"] = 0
+
+    def stream_info(login: str) -> dict:
+        started_at = app["started_at"].setdefault(login, dt.datetime.now(dt.UTC).replace(microsecond=0))
+        return {
+            "id": f"stream-{login}-{int(started_at.timestamp())}",
+            "title": app["titles"].get(login, f"{login} live"),
+            "createdAt": started_at.isoformat().replace("+00:00", "Z"),
+            "viewersCount": 42,
+            "game": {"displayName": "Just Chatting"},
+            "previewImageURL": f"https://static-cdn.jtvnw.net/previews-ttv/live_user_{login}-1280x720.jpg"
+        }
+
+    async def gql(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        payload = await request.json()
+        data = {}
+        for alias, login in TWITCH_GQL_USER_RE.findall(payload.get("query", "")):
+            if login.lower() in app["live_usernames"]:
+                data[alias] = {"stream": stream_info(login.lower())}
+            else:
+                app["started_at"].pop(login.lower(), None)
+                data[alias] = {"stream": None}
+        return web.json_response({"data": data})
+
+    async def token(request):
+        form = await request.post()
+        if form.get("grant_type") != "client_credentials" or not form.get("client_id") or not form.get("client_secret"):
+            return web.json_response({"status": 400, "message": "invalid client"}, status=400)
+        app["token_requests"] += 1
+        access_token = secrets.token_hex(8)
+        app["tokens"].add(access_token)
+        return web.json_response({"access_token": access_token, "expires_in": 3600, "token_type": "bearer"})
+
+    async def helix_streams(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if request.headers.get("Authorization", "").removeprefix("Bearer ") not in app["tokens"] or not request.headers.get("Client-ID"):
+            return web.json_response({"error": "Unauthorized", "status": 401, "message": "Invalid OAuth token"}, status=401)
+        logins = request.query.getall("user_login", [])
+        if len(logins) > 100:
+            return web.json_response({"error": "Bad Request", "status": 400, "message": "too many logins"}, status=400)
+        data = []
+        for login in logins:
+            if login.lower() not in app["live_usernames"]:
+                app["started_at"].pop(login.lower(), None)
+                continue
+            stream = stream_info(login.lower())
+            data.append({
+                "id": stream["id"],
+                "user_login": login.lower(),
+                "user_name": login,
+                "game_name": stream["game"]["displayName"],
+                "type": "live",
+                "title": stream["title"],
+                "viewer_count": stream["viewersCount"],
+                "started_at": stream["createdAt"],
+                "thumbnail_url": f"https://static-cdn.jtvnw.net/previews-ttv/live_user_{login.lower()}-{{width}}x{{height}}.jpg"
+            })
+        return web.json_response({"data": data, "pagination": {}})
+
+    app.add_routes([web.post("/gql", gql), web.post("/oauth2/token", token), web.get("/helix/streams", helix_streams)])
+    return app
+
+
+def youtube_atom_entry(channel_id: str, video_id: str, title: str, published: dt.datetime | None = None) -> str:
+    published = (published or dt.datetime.now(dt.UTC)).isoformat()
+    return (
+        "<entry>"
+        f"<id>yt:video:{video_id}</id>"
+        f"<yt:videoId>{video_id}</yt:videoId>"
+        f"<yt:channelId>{channel_id}</yt:channelId>"
+        f"<title>{escape(title)}</title>"
+        f'<link rel="alternate" href="https://www.youtube.com/watch?v={video_id}"/>'
+        f"<published>{published}</published>"
+        f"<updated>{published}</updated>"
+        "</entry>"
+    )
+
+
+def youtube_atom_feed(channel_id: str, entries: list[str], self_url: str | None = None) -> str:
+    self_url = self_url or f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">'
+        f'<link rel="self" href="{escape(self_url)}"/>'
+        f"<yt:channelId>{channel_id}</yt:channelId>"
+        + "".join(entries)
+        + "</feed>"
+    )
+
+
+def create_youtube_feed_app(channel_ids: list[str], entries_per_feed: int = 15, latency: float = 0.0) -> web.Application:
+    app = web.Application()
+    app["feeds"] = {channel_id: [] for channel_id in channel_ids}
+    app["versions"] = {channel_id: 0 for channel_id in channel_ids}
+    app["entries_per_feed"] = entries_per_feed
+    app["requests"] = 0
+    app["not_modified"] = 0
+    for channel_id in channel_ids:
+        for i in range(entries_per_feed):
+            upload(app, channel_id, f"{channel_id[-6:]}-seed{i}")
+
+    async def feed(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        channel_id = request.query.get("channel_id")
+        if channel_id not in app["feeds"]:
+            return web.Response(status=404)
+        etag = f'"{channel_id}-{app["versions"][channel_id]}"'
+        if request.headers.get("If-None-Match") == etag:
+            app["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        body = youtube_atom_feed(channel_id, app["feeds"][channel_id], feed_url(str(request.url.origin()), channel_id))
+        return web.Response(text=body, content_type="application/atom+xml", headers={"ETag": etag})
+
+    app.add_routes([web.get("/feeds/videos.xml", feed)])
+    return app
+
+
+def feed_url(base_url: str, channel_id: str) -> str:
+    return f"{base_url}/feeds/videos.xml?channel_id={channel_id}"
+
+
+def upload(app: web.Application, channel_id: str, video_id: str, title: str | None = None) -> str:
+    entries = app["feeds"][channel_id]
+    entries.insert(0, youtube_atom_entry(channel_id, video_id, title or f"Video {video_id}"))
+    del entries[app["entries_per_feed"]:]
+    app["versions"][channel_id] += 1
+    return video_id
+
+
+THUMBNAIL_BYTES = bytes.fromhex("ffd8ffe000104a46494600010100000100010000ffd9")
+
+
+def create_thumbnail_app(latency: float = 0.0, missing_maxres_ratio: float = 0.0) -> web.Application:
+    app = web.Application()
+    app["requests"] = 0
+
+    async def thumbnail(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        video_id = request.match_info["video_id"]
+        quality = request.match_info["quality"]
+        if quality == "maxresdefault" and zlib.crc32(video_id.encode()) % 1000 < missing_maxres_ratio * 1000:
+            return web.Response(status=404)
+        return web.Response(body=THUMBNAIL_BYTES, content_type="image/jpeg")
+
+    app.add_routes([web.get("/vi/{video_id}/{quality}.jpg", thumbnail)])
+    return app
+
+
+def create_discord_sink_app(latency: float = 0.0, rate_limit_every: int = 0, webhook_rate: int = 5, webhook_per: float = 2.0) -> web.Application:
+    app = web.Application()
+    app["messages"] = []
+    app["message_index"] = {}
+    app["message_ids"] = itertools.count(1)
+    app["edits"] = []
+    app["requests"] = 0
+    app["webhook_buckets"] = {}
+    app["rate_limited"] = 0
+
+    def take_webhook_token(webhook_id: str) -> tuple[dict, web.Response | None]:
+        now = time.monotonic()
+        bucket = app["webhook_buckets"].get(webhook_id)
+        if bucket is None or now >= bucket["reset_at"]:
+            bucket = app["webhook_buckets"][webhook_id] = {"remaining": webhook_rate, "reset_at": now + webhook_per}
+        reset_after = f"{bucket['reset_at'] - now:.3f}"
+        headers = {"X-RateLimit-Limit": str(webhook_rate), "X-RateLimit-Reset-After": reset_after, "X-RateLimit-Bucket": webhook_id}
+        if bucket["remaining"] <= 0:
+            app["rate_limited"] += 1
+            headers.update({"X-RateLimit-Remaining": "0", "Retry-After": reset_after})
+            return headers, web.json_response({"message": "You are being rate limited.", "retry_after": float(reset_after), "global": False}, status=429, headers=headers)
+        bucket["remaining"] -= 1
+        headers["X-RateLimit-Remaining"] = str(bucket["remaining"])
+        return headers, None
+
+    async def create_message(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if rate_limit_every and app["requests"] % rate_limit_every == 0:
+            return web.json_response({"message": "You are being rate limited.", "retry_after": 0.05, "global": False}, status=429, headers={"Retry-After": "0.05"})
+        payload = await request.json()
+        message_id = next(app["message_ids"])
+        app["messages"].append({"id": message_id, "channel_id": request.match_info["channel_id"], "received_at": time.monotonic(), **payload})
+        app["message_index"][message_id] = app["messages"][-1]
+        return web.json_response({"id": str(message_id), "channel_id": request.match_info["channel_id"]})
+
+    async def execute_webhook(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        webhook_id = request.match_info["webhook_id"]
+        headers, limited = take_webhook_token(webhook_id)
+        if limited:
+            return limited
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            payload = json.loads(form["payload_json"])
+            payload["files"] = [field.filename for name, field in form.items() if name.startswith("files[")]
+        else:
+            payload = await request.json()
+        message_id = next(app["message_ids"])
+        app["messages"].append({"id": message_id, "webhook_id": webhook_id, "query": dict(request.query), "received_at": time.monotonic(), **payload})
+        app["message_index"][message_id] = app["messages"][-1]
+        if request.query.get("wait") != "true":
+            return web.Response(status=204, headers=headers)
+        return web.json_response({"id": str(message_id), "channel_id": webhook_id, "webhook_id": webhook_id}, headers=headers)
+
+    async def edit_message(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        headers = {}
+        if "webhook_id" in request.match_info:
+            headers, limited = take_webhook_token(request.match_info["webhook_id"])
+            if limited:
+                return limited
+        message_id = int(request.match_info["message_id"])
+        if message_id not in app["message_index"]:
+            return web.json_response({"message": "Unknown Message", "code": 10008}, status=404, headers=headers)
+        payload = await request.json()
+        app["message_index"][message_id].update(payload)
+        app["edits"].append({"id": message_id, "received_at": time.monotonic(), **payload})
+        channel_id = request.match_info.get("channel_id") or request.match_info.get("webhook_id")
+        return web.json_response({"id": str(message_id), "channel_id": channel_id}, headers=headers)
+
+    app.add_routes([
+        web.post("/channels/{channel_id}/messages", create_message),
+        web.patch("/channels/{channel_id}/messages/{message_id}", edit_message),
+        web.post("/webhooks/{webhook_id}/{token}", execute_webhook),
+        web.patch("/webhooks/{webhook_id}/{token}/messages/{message_id}", edit_message)
+    ])
+    return app
+
+
+def create_websub_hub_app() -> web.Application:
+    app = web.Application()
+    app["subscriptions"] = {}
+    app["tasks"] = set()
+
+    async def verify(callback: str, mode: str, topic: str, secret: str | None, lease_seconds: int):
+        challenge = secrets.token_hex(8)
+        params = {"hub.mode": mode, "hub.topic": topic, "hub.challenge": challenge, "hub.lease_seconds": str(lease_seconds)}
+        async with aiohttp.ClientSession() as session:
+            async with session.get(callback, params=params) as resp:
+                if resp.status != 200 or (await resp.text()) != challenge:
+                    return
+        subscribers = app["subscriptions"].setdefault(topic, {})
+        if mode == "subscribe":
+            subscribers[callback] = secret
+        else:
+            subscribers.pop(callback, None)
+
+    async def subscribe(request):
+        form = await request.post()
+        callback = form.get("hub.callback")
+        mode = form.get("hub.mode")
+        topic = form.get("hub.topic")
+        if not callback or not topic or mode not in ("subscribe", "unsubscribe"):
+            return web.Response(status=400)
+        lease_seconds = int(form.get("hub.lease_seconds", 432000))
+        task = asyncio.create_task(verify(callback, mode, topic, form.get("hub.secret"), lease_seconds))
+        app["tasks"].add(task)
+        task.add_done_callback(app["tasks"].discard)
+        return web.Response(status=202)
+
+    async def publish_route(request):
+        topic = request.query["topic"]
+        delivered = await publish(app, topic, await request.read())
+        return web.json_response({"delivered": delivered})
+
+    app.add_routes([web.post("/subscribe", subscribe), web.post("/publish", publish_route)])
+    return app
+
+
+async def publish(app: web.Application, topic: str, body: bytes | str) -> int:
+    if isinstance(body, str):
+        body = body.encode()
+    delivered = 0
+    async with aiohttp.ClientSession() as session:
+        for callback, secret in list(app["subscriptions"].get(topic, {}).items()):
+            headers = {"Content-Type": "application/atom+xml", "Link": f'<{topic}>; rel="self"'}
+            if secret:
+                headers["X-Hub-Signature"] = "sha1=" + hmac.new(secret.encode(), body, hashlib.sha1).hexdigest()
+            async with session.post(callback, data=body, headers=headers) as resp:
+                if resp.status < 300:
+                    delivered += 1
+    return delivered
+
+
+async def start_stand_in(app: web.Application, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+async def serve(app: web.Application, host: str, port: int):
+    runner, base_url = await start_stand_in(app, host, port)
+    print(f"Stand-in listening on {base_url}", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-ins for external services used by the bot")
+    parser.add_argument("service", choices=["twitch", "websub", "youtube", "thumbnails", "discord"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--live", default="", help="Comma-separated Twitch logins reported as live")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--channels", type=int, default=10, help="Number of generated YouTube channels")
+    args = parser.parse_args()
+    if args.service == "twitch":
+        app = create_twitch_app({name for name in args.live.split(",") if name}, args.latency)
+    elif args.service == "websub":
+        app = create_websub_hub_app()
+    elif args.service == "youtube":
+        app = create_youtube_feed_app([f"UC{i:022d}" for i in range(args.channels)], latency=args.latency)
+    elif args.service == "thumbnails":
+        app = create_thumbnail_app(args.latency)
+    elif args.service == "discord":
+        app = create_discord_sink_app(args.latency)
+    asyncio.run(serve(app, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import asyncio
+import tempfile
+import importlib
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="bot-tests-")
+
+sys.path.insert(0, ROOT)
+os.chdir(WORKDIR)
+os.environ.update({
+    "DISCORD_TOKEN": "test",
+    "ENABLE_TELEGRAM": "0",
+    "ENABLE_WEBSERVER": "0",
+    "LOG_LEVEL": "WARNING",
+    "STATE_FILE": os.path.join(WORKDIR, "state.json"),
+    "STATE_DB": os.path.join(WORKDIR, "state.sqlite3"),
+    "TEMPLATES_FILE": os.path.join(WORKDIR, "templates.json"),
+    "WEBHOOKS_FILE": os.path.join(WORKDIR, "webhooks.json"),
+    "COORDINATION_DB": os.path.join(WORKDIR, "coordination.sqlite3"),
+    "COORDINATION_DIR": os.path.join(WORKDIR, "coordination"),
+})
+
+
+@pytest.fixture(scope="session")
+def main():
+    return importlib.import_module("main")
+
+
+@pytest.fixture
+def bot(main, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "seen_videos", main.SeenVideoIndex(main.SEEN_VIDEOS_LIMIT))
+    monkeypatch.setattr(main, "coordinator", main.Coordinator())
+    monkeypatch.setattr(main, "dispatcher", main.DiscordDispatcher(workers=2, max_retries=3))
+    monkeypatch.setattr(main, "state_store", main.JsonStateStore(str(tmp_path / "state.json")))
+    monkeypatch.setattr(main, "twitch_streams", {})
+    monkeypatch.setattr(main, "twitch_live_status", {})
+    monkeypatch.setattr(main, "websub_leases", {})
+    monkeypatch.setattr(main, "websub_tasks", set())
+    monkeypatch.setattr(main, "save_state", lambda: None)
+    monkeypatch.setattr(main, "send_lock", None)
+    return main
+
+
+@pytest.fixture
+def run(bot):
+    def run(coro):
+        async def wrapper():
+            bot.http_session = bot.create_http_session()
+            bot.send_lock = asyncio.Lock()
+            bot.dispatcher.start()
+            try:
+                return await coro
+            finally:
+                await bot.dispatcher.stop()
+                await bot.close_http_session()
+        return asyncio.run(wrapper())
+    return run
@@ -0,0 +1,44 @@
+import aiohttp
+import pytest
+import stand_ins
+
+
+@pytest.fixture
+def sink():
+    return stand_ins.create_discord_sink_app(webhook_rate=1, webhook_per=0.3)
+
+
+def test_webhook_429_is_retried_after_retry_after(bot, run, sink):
+    async def scenario():
+        runner, base_url = await stand_ins.start_stand_in(sink)
+        try:
+            url = f"{base_url}/webhooks/1/token"
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, json={"content": "warm-up"}) as resp:
+                    assert resp.status == 204
+            message = await bot.dispatcher.send(bot.WebhookChannel(1, url), bot.PRIORITY_NEWS, content="hello")
+        finally:
+            await runner.cleanup()
+        return message
+
+    message = run(scenario())
+    assert sink["rate_limited"] == 1
+    assert bot.dispatcher.metrics["retried"] == 1
+    assert bot.dispatcher.metrics["sent"] == 1
+    assert sink["message_index"][message.id]["content"] == "hello"
+
+
+def test_webhook_client_error_is_not_retried(bot, run, sink):
+    async def scenario():
+        runner, base_url = await stand_ins.start_stand_in(sink)
+        try:
+            channel = bot.WebhookChannel(1, f"{base_url}/webhooks/1/token")
+            with pytest.raises(bot.WebhookHTTPError) as error:
+                await bot.dispatcher.edit(channel, 404404, embed=None)
+        finally:
+            await runner.cleanup()
+        return error.value
+
+    assert run(scenario()).status == 404
+    assert bot.dispatcher.metrics["retried"] == 0
+    assert bot.dispatcher.metrics["failed"] == 1
@@ -0,0 +1,108 @@
+import json
+import asyncio
+import datetime as dt
+import pytest
+import stand_ins
+
+
+@pytest.fixture
+def sink():
+    return stand_ins.create_discord_sink_app(webhook_rate=50)
+
+
+def fan_out_twice(bot, run, monkeypatch, sink, tmp_path, channel_ids):
+    first = bot.SqliteCoordinator(str(tmp_path / "coordination.sqlite3"), instance_id="first")
+    second = bot.SqliteCoordinator(str(tmp_path / "coordination.sqlite3"), instance_id="second")
+    monkeypatch.setattr(bot, "DELIVERY_BACKEND", "webhook")
+
+    async def scenario():
+        runner, base_url = await stand_ins.start_stand_in(sink)
+        monkeypatch.setattr(bot, "webhook_channels", {channel_id: bot.WebhookChannel(channel_id, f"{base_url}/webhooks/{channel_id}/token") for channel_id in (1, 2)})
+        results = []
+        try:
+            for coordinator in (first, second):
+                monkeypatch.setattr(bot, "coordinator", coordinator)
+                results.append(await bot.fan_out("youtube:abc", "youtube", channel_ids, bot.PRIORITY_VIDEO, lambda channel: {"content": "new video"}, idempotency_key="youtube:abc"))
+        finally:
+            await runner.cleanup()
+            first.close()
+            second.close()
+        return results
+
+    return run(scenario())
+
+
+def test_second_instance_skips_delivered_targets(bot, run, monkeypatch, sink, tmp_path):
+    first, second = fan_out_twice(bot, run, monkeypatch, sink, tmp_path, [1, 2])
+    assert (first.delivered, first.duplicates) == (2, 0)
+    assert (second.delivered, second.duplicates) == (0, 2)
+    assert len(sink["messages"]) == 2
+
+
+def test_failed_target_is_released_for_retry(bot, run, monkeypatch, sink, tmp_path):
+    first, second = fan_out_twice(bot, run, monkeypatch, sink, tmp_path, [1, 3])
+    assert [(target.channel_id, target.ok, target.duplicate) for target in first.targets] == [(1, True, False), (3, False, False)]
+    assert [(target.channel_id, target.ok, target.duplicate) for target in second.targets] == [(1, False, True), (3, False, False)]
+    assert second.targets[1].error == bot.DISCORD_CHANNEL_ERROR
+
+
+def test_deliveries_without_key_are_not_deduplicated(bot, run, monkeypatch, sink):
+    monkeypatch.setattr(bot, "DELIVERY_BACKEND", "webhook")
+
+    async def scenario():
+        runner, base_url = await stand_ins.start_stand_in(sink)
+        monkeypatch.setattr(bot, "webhook_channels", {1: bot.WebhookChannel(1, f"{base_url}/webhooks/1/token")})
+        try:
+            return [await bot.fan_out("twitch:alice", "twitch", [1], bot.PRIORITY_LIVE, lambda channel: {"content": "live"}) for _ in range(2)]
+        finally:
+            await runner.cleanup()
+
+    assert [result.delivered for result in run(scenario())] == [1, 1]
+    assert len(sink["messages"]) == 2
+
+
+def test_new_leader_announces_uploads_missed_during_takeover(bot, run, monkeypatch, sink, tmp_path):
+    channel_id = "UCtakeover0000000000000"
+    now = dt.datetime.now(dt.UTC)
+    feeds = stand_ins.create_youtube_feed_app([channel_id], entries_per_feed=5)
+    feeds["feeds"][channel_id] = [stand_ins.youtube_atom_entry(channel_id, f"old{i:08d}", f"Old {i}", now - dt.timedelta(days=i + 1)) for i in range(3)]
+    first = bot.SqliteCoordinator(str(tmp_path / "coordination.sqlite3"), instance_id="first", mode="leader", ttl=0.3)
+    second = bot.SqliteCoordinator(str(tmp_path / "coordination.sqlite3"), instance_id="second", mode="leader", ttl=0.3)
+    monkeypatch.setattr(bot, "DELIVERY_BACKEND", "webhook")
+    monkeypatch.setattr(bot, "YOUTUBE_TARGET_CHANNEL_IDS", [1])
+    monkeypatch.setattr(bot, "feed_validators", {})
+
+    async def resolve_youtube_thumbnail(video_id):
+        return None
+
+    monkeypatch.setattr(bot, "resolve_youtube_thumbnail", resolve_youtube_thumbnail)
+
+    async def scenario():
+        feeds_runner, feeds_url = await stand_ins.start_stand_in(feeds)
+        sink_runner, sink_url = await stand_ins.start_stand_in(sink)
+        feed_url = stand_ins.feed_url(feeds_url, channel_id)
+        monkeypatch.setattr(bot, "webhook_channels", {1: bot.WebhookChannel(1, f"{sink_url}/webhooks/1/token")})
+        try:
+            assert await first.refresh() and first.leader
+            monkeypatch.setattr(bot, "coordinator", first)
+            await bot.poll_youtube([feed_url])
+            stand_ins.upload(feeds, channel_id, "announced01")
+            await bot.poll_youtube([feed_url])
+            stand_ins.upload(feeds, channel_id, "gapvideo001")
+            await asyncio.sleep(0.4)
+            assert await second.refresh() and second.leader
+            monkeypatch.setattr(bot, "coordinator", second)
+            monkeypatch.setattr(bot, "seen_videos", bot.SeenVideoIndex(bot.SEEN_VIDEOS_LIMIT))
+            monkeypatch.setattr(bot, "feed_validators", {})
+            await bot.poll_youtube([feed_url])
+            await bot.poll_youtube([feed_url])
+        finally:
+            await feeds_runner.cleanup()
+            await sink_runner.cleanup()
+            first.close()
+            second.close()
+
+    run(scenario())
+    posted = [json.dumps(message) for message in sink["messages"]]
+    assert [video_id for video_id in ("announced01", "gapvideo001") for message in posted if video_id in message] == ["announced01", "gapvideo001"]
+    assert not any("old" in message for message in posted)
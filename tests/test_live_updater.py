@@ -0,0 +1,94 @@
+import json
+import time
+import asyncio
+import pytest
+import stand_ins
+
+
+@pytest.fixture
+def live(bot, monkeypatch):
+    sink = stand_ins.create_discord_sink_app(webhook_rate=50)
+    monkeypatch.setattr(bot, "DELIVERY_BACKEND", "webhook")
+    monkeypatch.setattr(bot, "TWITCH_TARGET_CHANNEL_IDS", [1, 2])
+    monkeypatch.setattr(bot, "live_updater", bot.LiveUpdater(interval=0))
+
+    async def update_presence(live_usernames):
+        pass
+
+    monkeypatch.setattr(bot, "update_presence", update_presence)
+    return sink
+
+
+def go_live(bot, stream_id="stream-1", title="First title"):
+    bot.twitch_streams["alice"] = {"id": stream_id, "title": title, "game": "Just Chatting", "started_at": time.time() - 600, "thumbnail": None, "viewers": 1}
+
+
+def run_live(bot, run, monkeypatch, sink, scenario):
+    async def wrapper():
+        runner, base_url = await stand_ins.start_stand_in(sink)
+        monkeypatch.setattr(bot, "webhook_channels", {channel_id: bot.WebhookChannel(channel_id, f"{base_url}/webhooks/{channel_id}/token") for channel_id in (1, 2)})
+        try:
+            go_live(bot)
+            await bot.process_twitch_statuses({"alice": True})
+            await scenario()
+        finally:
+            await runner.cleanup()
+
+    run(wrapper())
+    return [json.dumps(edit, ensure_ascii=False) for edit in sink["edits"]]
+
+
+def test_unchanged_stream_is_not_edited(bot, run, monkeypatch, live):
+    async def scenario():
+        await bot.process_twitch_statuses({"alice": True})
+
+    assert run_live(bot, run, monkeypatch, live, scenario) == []
+    assert sorted(bot.live_updater.announcements["alice"].messages) == [1, 2]
+
+
+def test_changes_within_interval_are_coalesced_into_one_deferred_edit(bot, run, monkeypatch, live):
+    async def scenario():
+        bot.live_updater.interval = 0.3
+        for title in ("Second title", "Third title"):
+            go_live(bot, title=title)
+            await bot.process_twitch_statuses({"alice": True})
+        assert live["edits"] == []
+        await asyncio.gather(*bot.live_updater.deferred.values())
+
+    edits = run_live(bot, run, monkeypatch, live, scenario)
+    assert len(edits) == 2
+    assert all("Third title" in edit for edit in edits)
+
+
+def test_stream_end_finalizes_announcement(bot, run, monkeypatch, live):
+    async def scenario():
+        await bot.process_twitch_statuses({"alice": False})
+
+    edits = run_live(bot, run, monkeypatch, live, scenario)
+    assert len(edits) == 2
+    assert all("завершил стрим" in edit and "10 мин" in edit for edit in edits)
+    assert "alice" not in bot.live_updater.announcements
+
+
+def test_deleted_message_is_dropped_from_announcement(bot, run, monkeypatch, live):
+    async def scenario():
+        announcement = bot.live_updater.announcements["alice"]
+        del live["message_index"][announcement.messages[2]]
+        go_live(bot, title="Second title")
+        await bot.process_twitch_statuses({"alice": True})
+
+    edits = run_live(bot, run, monkeypatch, live, scenario)
+    assert len(edits) == 1
+    assert list(bot.live_updater.announcements["alice"].messages) == [1]
+
+
+def test_new_stream_id_finalizes_old_announcement_and_posts_again(bot, run, monkeypatch, live):
+    async def scenario():
+        go_live(bot, stream_id="stream-2")
+        await bot.process_twitch_statuses({"alice": True})
+
+    edits = run_live(bot, run, monkeypatch, live, scenario)
+    assert len(edits) == 2
+    assert all("завершил стрим" in edit for edit in edits)
+    assert len(live["messages"]) == 4
+    assert bot.live_updater.announcements["alice"].stream_id == "stream-2"
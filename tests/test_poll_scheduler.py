@@ -0,0 +1,30 @@
+import random
+
+
+def test_single_event_does_not_make_its_window_hot(main):
+    source = main.PollSource("twitch", "alice", [30])
+    assert not source.is_hot(30)
+
+
+def test_recurring_upload_hour_is_hot(main):
+    source = main.PollSource("twitch", "alice", [30, 30, 31])
+    assert source.is_hot(30)
+    assert source.is_hot(31)
+    assert not source.is_hot(90)
+
+
+def test_scattered_activity_keeps_hot_share_bounded(main):
+    rng = random.Random(7)
+    source = main.PollSource("twitch", "alice", [rng.randrange(168) for _ in range(main.POLL_ACTIVITY_HISTORY)])
+    assert len(source.hot_hours) <= int(168 * main.POLL_HOT_MAX_SHARE)
+
+
+def test_recording_an_event_updates_hot_hours(main):
+    source = main.PollSource("twitch", "alice", [])
+    now = main.dt.datetime.now(main.dt.UTC)
+    hour_of_week = now.weekday() * 24 + now.hour
+    source.record(event=True)
+    assert not source.is_hot(hour_of_week)
+    source.record(event=True)
+    assert source.is_hot(hour_of_week)
+    assert source.interval == source.min_interval
@@ -0,0 +1,52 @@
+import datetime as dt
+import pytest
+import stand_ins
+
+
+CHANNEL_ID = "UCseentest00000000000000"
+FEED_URL = f"https://www.youtube.com/feeds/videos.xml?channel_id={CHANNEL_ID}"
+NOW = dt.datetime.now(dt.UTC)
+
+
+def feed(bot, *videos):
+    entries = [stand_ins.youtube_atom_entry(CHANNEL_ID, video_id, f"Video {video_id}", NOW - dt.timedelta(hours=age)) for video_id, age in videos]
+    return bot.parse_feed_body(stand_ins.youtube_atom_feed(CHANNEL_ID, entries).encode())
+
+
+@pytest.fixture
+def legacy(bot, monkeypatch):
+    ids = {}
+    monkeypatch.setattr(bot, "legacy_last_video_ids", ids)
+    return ids
+
+
+def test_new_source_is_seeded_without_announcements(bot, legacy):
+    assert bot.find_new_feed_videos(FEED_URL, feed(bot, ("video000003", 1), ("video000002", 2), ("video000001", 3))) == []
+    assert all(bot.seen_videos.is_seen(FEED_URL, video_id) for video_id in ("video000001", "video000002", "video000003"))
+
+
+def test_migrated_legacy_id_announces_newer_videos_oldest_first(bot, legacy):
+    legacy[FEED_URL] = "video000001"
+    videos = bot.find_new_feed_videos(FEED_URL, feed(bot, ("video000003", 1), ("video000002", 2), ("video000001", 3)))
+    assert [video["title"] for video in videos] == ["Video video000002", "Video video000003"]
+    assert FEED_URL not in legacy
+
+
+def test_unseen_videos_are_announced_in_publish_order(bot, legacy):
+    bot.seen_videos.add(FEED_URL, "video000001")
+    videos = bot.find_new_feed_videos(FEED_URL, feed(bot, ("video000002", 2), ("video000004", 1), ("video000003", 3), ("video000001", 4)))
+    assert [video["title"] for video in videos] == ["Video video000003", "Video video000002", "Video video000004"]
+    assert bot.find_new_feed_videos(FEED_URL, feed(bot, ("video000004", 1), ("video000002", 2))) == []
+
+
+def test_index_keeps_the_most_recent_ids_per_source(main):
+    index = main.SeenVideoIndex(limit=2)
+    for video_id in ("a", "b", "c"):
+        index.add(FEED_URL, video_id)
+    index.add("other", "a")
+    assert index.to_dict() == {FEED_URL: ["b", "c"], "other": ["a"]}
+    restored = main.SeenVideoIndex(limit=2)
+    restored.load(index.to_dict())
+    restored.add(FEED_URL, "b")
+    restored.add(FEED_URL, "d")
+    assert restored.to_dict()[FEED_URL] == ["b", "d"]
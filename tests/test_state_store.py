@@ -0,0 +1,49 @@
+import json
+import asyncio
+
+
+def flaky_store(main, tmp_path, failures, max_delay=0.05):
+    store = main.JsonStateStore(str(tmp_path / "state.json"), flush_delay=0.01, max_delay=max_delay)
+    write = store.write
+    attempts = []
+
+    def flaky_write(snapshot):
+        attempts.append(dict(snapshot))
+        if len(attempts) <= failures:
+            raise OSError("No space left on device")
+        write(snapshot)
+
+    store.write = flaky_write
+    return store, attempts
+
+
+def test_keys_from_failed_flush_are_written_by_next_flush(main, tmp_path):
+    store, attempts = flaky_store(main, tmp_path, failures=1)
+
+    async def scenario():
+        store.put_many({"seen_videos": {"feed": ["a"]}})
+        await store.flush()
+        assert store.dirty == {"seen_videos"}
+        store.put_many({"twitch_live_status": {"alice": True}})
+        await store.flush()
+        store.flush_task.cancel()
+
+    asyncio.run(scenario())
+    assert len(attempts) == 2
+    assert store.dirty == set()
+    assert store.failures == 0
+    with open(tmp_path / "state.json") as f:
+        assert json.load(f) == {"seen_videos": {"feed": ["a"]}, "twitch_live_status": {"alice": True}}
+
+
+def test_repeated_failures_back_off(main, tmp_path):
+    store, attempts = flaky_store(main, tmp_path, failures=100, max_delay=0.2)
+
+    async def scenario():
+        store.put_many({"seen_videos": {}})
+        await asyncio.sleep(0.5)
+        store.flush_task.cancel()
+
+    asyncio.run(scenario())
+    assert 3 <= len(attempts) <= 8
+    assert store.dirty == {"seen_videos"}
@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture
+def clock(main, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def removed():
+    return []
+
+
+@pytest.fixture
+def cache(main, clock, removed):
+    return main.TTLCache(maxsize=2, ttl=10, on_evict=lambda key, value, reason: removed.append((key, value, reason)))
+
+
+def test_least_recently_used_entry_is_evicted(cache, removed):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert removed == [("b", 2, "evicted")]
+    assert cache.get("b", None) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entry_is_dropped_on_get(cache, clock, removed):
+    cache.set("a", 1)
+    clock[0] += 10
+    assert cache.get("a", "missing") == "missing"
+    assert removed == [("a", 1, "expired")]
+    assert cache.stats()["expiries"] == 1
+
+
+def test_set_sweeps_expired_entries_before_evicting(cache, clock, removed):
+    cache.set("a", 1, ttl=5)
+    cache.set("b", 2)
+    clock[0] += 6
+    cache.set("c", 3)
+    assert removed == [("a", 1, "expired")]
+    assert len(cache) == 2
+
+
+def test_pop_does_not_notify(cache, removed):
+    cache.set("a", 1)
+    assert cache.pop("a") == 1
+    assert removed == []
+
+
+def test_failing_callback_does_not_break_cache(main, clock):
+    def on_evict(key, value, reason):
+        raise RuntimeError("boom")
+
+    cache = main.TTLCache(maxsize=1, ttl=10, on_evict=on_evict)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("b") == 2
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import stand_ins
+
+
+@pytest.fixture
+def twitch():
+    return stand_ins.create_twitch_app({"alice"})
+
+
+@pytest.fixture
+def streamlink_checks(bot, monkeypatch):
+    checked = []
+
+    def streamlink_streams(url):
+        checked.append(url)
+        return {"best": object()} if url.endswith("/alice") else {}
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(bot, "twitch_executor", executor)
+    monkeypatch.setattr(bot, "twitch_checks_in_flight", {})
+    monkeypatch.setattr(bot, "streamlink_streams", streamlink_streams)
+    yield checked
+    executor.shutdown(wait=False)
+
+
+def helix(bot, base_url, path="/helix", batch_size=2):
+    return bot.TwitchHelixLivenessProvider(url=base_url + path, token_url=base_url + "/oauth2/token", client_id="client", client_secret="secret", batch_size=batch_size)
+
+
+def gql(bot, base_url, path="/gql"):
+    return bot.TwitchGQLLivenessProvider(url=base_url + path, client_id="client", batch_size=2)
+
+
+def check(bot, run, app, create_provider, usernames, rounds=1, between=None):
+    async def scenario():
+        runner, base_url = await stand_ins.start_stand_in(app)
+        try:
+            provider = bot.FallbackLivenessProvider(create_provider(bot, base_url), bot.StreamlinkLivenessProvider())
+            for i in range(rounds):
+                if i and between:
+                    between()
+                statuses = await provider.check(usernames)
+            return statuses
+        finally:
+            await runner.cleanup()
+
+    return run(scenario())
+
+
+def test_helix_reports_liveness_and_stream_metadata(bot, run, twitch, streamlink_checks):
+    statuses = check(bot, run, twitch, helix, ["alice", "Bob", "carol"])
+    assert statuses == {"alice": True, "Bob": False, "carol": False}
+    assert (twitch["requests"], twitch["token_requests"]) == (2, 1)
+    assert streamlink_checks == []
+    stream = bot.twitch_streams["alice"]
+    assert stream["id"].startswith("stream-alice-")
+    assert (stream["title"], stream["game"], stream["viewers"]) == ("alice live", "Just Chatting", 42)
+    assert stream["thumbnail"].endswith("live_user_alice-1280x720.jpg")
+    assert stream["started_at"] > 0
+
+
+def test_helix_refreshes_rejected_app_token(bot, run, twitch, streamlink_checks):
+    statuses = check(bot, run, twitch, lambda bot, base_url: helix(bot, base_url, batch_size=100), ["alice", "bob"], rounds=2, between=twitch["tokens"].clear)
+    assert statuses == {"alice": True, "bob": False}
+    assert (twitch["requests"], twitch["token_requests"]) == (3, 2)
+    assert streamlink_checks == []
+
+
+def test_helix_failure_falls_back_to_streamlink(bot, run, twitch, streamlink_checks):
+    statuses = check(bot, run, twitch, lambda bot, base_url: helix(bot, base_url, path="/missing"), ["alice", "bob"])
+    assert statuses == {"alice": True, "bob": False}
+    assert sorted(streamlink_checks) == ["https://twitch.tv/alice", "https://twitch.tv/bob"]
+    assert "alice" not in bot.twitch_streams
+
+
+def test_gql_reports_liveness_and_stream_metadata(bot, run, twitch, streamlink_checks):
+    statuses = check(bot, run, twitch, gql, ["alice", "bob", "carol"])
+    assert statuses == {"alice": True, "bob": False, "carol": False}
+    assert twitch["requests"] == 2
+    assert streamlink_checks == []
+    stream = bot.twitch_streams["alice"]
+    assert stream["id"].startswith("stream-alice-")
+    assert stream["title"] == "alice live"
+    assert stream["started_at"] > 0
+
+
+def test_gql_failure_falls_back_to_streamlink(bot, run, twitch, streamlink_checks):
+    statuses = check(bot, run, twitch, lambda bot, base_url: gql(bot, base_url, path="/missing"), ["alice", "bob"])
+    assert statuses == {"alice": True, "bob": False}
+    assert sorted(streamlink_checks) == ["https://twitch.tv/alice", "https://twitch.tv/bob"]
+    assert "alice" not in bot.twitch_streams
@@ -0,0 +1,138 @@
+import asyncio
+import contextlib
+import datetime as dt
+import aiohttp
+import pytest
+from aiohttp import web
+import stand_ins
+
+
+CHANNEL_ID = "UCwebsubtest0000000000000"
+FEED_URL = f"https://www.youtube.com/feeds/videos.xml?channel_id={CHANNEL_ID}"
+
+
+@pytest.fixture
+def announced(bot, monkeypatch):
+    videos = []
+
+    async def send_youtube_notification(video, **kwargs):
+        videos.append(video)
+
+    monkeypatch.setattr(bot, "YOUTUBE_FEEDS", [FEED_URL])
+    monkeypatch.setattr(bot, "websub_secret", "test-secret")
+    monkeypatch.setattr(bot, "send_youtube_notification", send_youtube_notification)
+    bot.seen_videos.add(FEED_URL, "known000001")
+    return videos
+
+
+@contextlib.asynccontextmanager
+async def websub_stand_ins(bot, monkeypatch, feed_url=FEED_URL):
+    app = web.Application()
+    app.add_routes([web.get("/websub", bot.websub_verify_handler), web.post("/websub", bot.websub_notify_handler)])
+    hub = stand_ins.create_websub_hub_app()
+    runner, base_url = await stand_ins.start_stand_in(app)
+    hub_runner, hub_url = await stand_ins.start_stand_in(hub)
+    monkeypatch.setattr(bot, "WEBSUB_CALLBACK_URL", f"{base_url}/websub")
+    monkeypatch.setattr(bot, "WEBSUB_HUB_URL", f"{hub_url}/subscribe")
+    try:
+        assert await bot.websub_subscribe(feed_url)
+        await asyncio.gather(*list(hub["tasks"]))
+        yield hub
+    finally:
+        await runner.cleanup()
+        await hub_runner.cleanup()
+
+
+async def publish(bot, hub, entries, feed_url=FEED_URL):
+    topic = bot.websub_topic(feed_url)
+    delivered = await stand_ins.publish(hub, topic, stand_ins.youtube_atom_feed(CHANNEL_ID, entries, topic))
+    await asyncio.gather(*list(bot.websub_tasks))
+    return delivered
+
+
+def test_subscription_is_verified_and_signed_push_is_announced(bot, run, announced, monkeypatch):
+    async def scenario():
+        async with websub_stand_ins(bot, monkeypatch) as hub:
+            topic = bot.websub_topic(FEED_URL)
+            assert hub["subscriptions"][topic] == {bot.WEBSUB_CALLBACK_URL: "test-secret"}
+            assert bot.websub_leases[topic] > 0
+            assert await publish(bot, hub, [stand_ins.youtube_atom_entry(CHANNEL_ID, "fresh000001", "Fresh upload")]) == 1
+
+    run(scenario())
+    assert [video["title"] for video in announced] == ["Fresh upload"]
+    assert bot.seen_videos.is_seen(FEED_URL, "fresh000001")
+
+
+def test_push_with_bad_signature_is_dropped(bot, run, announced, monkeypatch):
+    async def scenario():
+        async with websub_stand_ins(bot, monkeypatch) as hub:
+            hub["subscriptions"][bot.websub_topic(FEED_URL)][bot.WEBSUB_CALLBACK_URL] = "wrong-secret"
+            assert await publish(bot, hub, [stand_ins.youtube_atom_entry(CHANNEL_ID, "forged00001", "Forged")]) == 1
+            async with aiohttp.ClientSession() as session:
+                async with session.post(bot.WEBSUB_CALLBACK_URL, data=b"<feed/>") as resp:
+                    assert resp.status == 202
+
+    run(scenario())
+    assert announced == []
+    assert not bot.seen_videos.is_seen(FEED_URL, "forged00001")
+
+
+def test_verification_for_unknown_topic_is_refused(bot, run, announced, monkeypatch):
+    async def scenario():
+        async with websub_stand_ins(bot, monkeypatch):
+            params = {"hub.mode": "subscribe", "hub.topic": "https://example.com/other", "hub.challenge": "abc"}
+            async with aiohttp.ClientSession() as session:
+                async with session.get(bot.WEBSUB_CALLBACK_URL, params=params) as resp:
+                    return resp.status
+
+    assert run(scenario()) == 404
+
+
+def test_push_for_edited_old_video_is_not_announced(bot, run, announced, monkeypatch):
+    published = dt.datetime.now(dt.UTC) - dt.timedelta(days=400)
+
+    async def scenario():
+        async with websub_stand_ins(bot, monkeypatch) as hub:
+            await publish(bot, hub, [stand_ins.youtube_atom_entry(CHANNEL_ID, "oldvideo001", "Renamed", published)])
+
+    run(scenario())
+    assert announced == []
+    assert bot.seen_videos.is_seen(FEED_URL, "oldvideo001")
+
+
+def old_entries(count):
+    now = dt.datetime.now(dt.UTC)
+    return [stand_ins.youtube_atom_entry(CHANNEL_ID, f"oldvideo{i:03d}", f"Old {i}", now - dt.timedelta(days=i + 1)) for i in range(count)]
+
+
+def push_to_unpolled_feed(bot, run, monkeypatch, upload, pushed):
+    feeds = stand_ins.create_youtube_feed_app([CHANNEL_ID], entries_per_feed=6)
+    feeds["feeds"][CHANNEL_ID] = old_entries(5)
+    monkeypatch.setattr(bot, "has_target_channel", lambda channel_ids: True)
+
+    async def scenario():
+        runner, base_url = await stand_ins.start_stand_in(feeds)
+        feed_url = stand_ins.feed_url(base_url, CHANNEL_ID)
+        monkeypatch.setattr(bot, "YOUTUBE_FEEDS", [feed_url])
+        if upload:
+            feeds["feeds"][CHANNEL_ID].insert(0, stand_ins.youtube_atom_entry(CHANNEL_ID, upload, "Fresh upload"))
+        try:
+            async with websub_stand_ins(bot, monkeypatch, feed_url) as hub:
+                await publish(bot, hub, [entry for entry in feeds["feeds"][CHANNEL_ID] if pushed in entry], feed_url)
+            await bot.poll_youtube([feed_url])
+        finally:
+            await runner.cleanup()
+        return feed_url
+
+    return run(scenario())
+
+
+def test_push_for_old_video_on_unpolled_feed_seeds_from_rss(bot, run, announced, monkeypatch):
+    feed_url = push_to_unpolled_feed(bot, run, monkeypatch, None, "oldvideo003")
+    assert announced == []
+    assert all(bot.seen_videos.is_seen(feed_url, f"oldvideo{i:03d}") for i in range(5))
+
+
+def test_push_for_new_upload_on_unpolled_feed_is_announced_once(bot, run, announced, monkeypatch):
+    push_to_unpolled_feed(bot, run, monkeypatch, "fresh000001", "fresh000001")
+    assert [video["title"] for video in announced] == ["Fresh upload"]